@@ -0,0 +1,120 @@
+"""
+shell word splitting for compile commands.
+
+shlex.split is slow(it read char by char), but it's called for every command when parse log,
+and for every GetFlags when serve. so here is a regex version which has same result as posix shlex.split,
+and fallback to shlex when the command has unsupported syntax(eg: unclosed quote).
+"""
+
+from functools import lru_cache
+import re
+import shlex
+from typing import List, Optional
+
+# shlex posix whitespace, not unicode \s
+WHITESPACE = " \t\r\n"
+
+# posix shell word: unquoted char, \ escaped char, 'single quoted', "double quoted", join without whitespace
+word_pattern = re.compile(
+    r"""
+    (?:
+        [^ \t\r\n'"\\] |          # unquoted char
+        \\. |                     # like xxx\ xxx
+        '[^']*' |                 # like 'xxx xxx'
+        "(?:[^"\\]|\\.)*"         # like "xxx xxx", allow \"
+    )+
+    """,
+    re.X | re.S,
+)
+plain_word_pattern = re.compile(r"[^ \t\r\n]+")
+piece_pattern = re.compile(
+    r"""
+    \\(.) |
+    '([^']*)' |
+    "((?:[^"\\]|\\.)*)" |
+    ([^'"\\]+)
+    """,
+    re.X | re.S,
+)
+# in double quote, shlex only unescape quote and escape char
+dquote_escape_pattern = re.compile(r'\\([\\"])')
+
+
+def unquote(word: str) -> str:
+    """remove quote and escape in a matched shell word"""
+    if not ("\\" in word or "'" in word or '"' in word):
+        return word
+
+    def extract(m):
+        if m.lastindex == 3:
+            return dquote_escape_pattern.sub(r"\1", m.group(3))
+        return m.group(m.lastindex)
+
+    return "".join(extract(m) for m in piece_pattern.finditer(word))
+
+
+def split_fast(s: str) -> Optional[List[str]]:
+    """split as posix shlex.split, return None if s has syntax not supported"""
+    if not ("\\" in s or "'" in s or '"' in s):
+        return plain_word_pattern.findall(s)
+
+    words = []
+    end = 0
+    for m in word_pattern.finditer(s):
+        if s[end : m.start()].strip(WHITESPACE):
+            return None  # unmatched chars between words, eg: unclosed quote or trailing escape
+        words.append(unquote(m.group()))
+        end = m.end()
+    if s[end:].strip(WHITESPACE):
+        return None
+    return words
+
+
+def split(s: str) -> List[str]:
+    """split as shlex.split, without memoize"""
+    words = split_fast(s)
+    if words is None:
+        words = shlex.split(s)  # shlex is more right, and raise same error for invalid command
+    return words
+
+
+@lru_cache(maxsize=256)
+def _cmd_split(s: str):
+    return tuple(split(s))
+
+
+def cmd_split(s: str) -> List[str]:
+    """split command as shlex.split. result is memoized by command string"""
+    return list(_cmd_split(s))
+
+
+def verify(commands) -> List[str]:
+    """return commands which split_fast result differ from shlex.split"""
+    mismatch = []
+    for command in commands:
+        try:
+            expect = shlex.split(command)
+        except ValueError:
+            expect = None
+        words = split_fast(command)
+        if words is not None and words != expect:
+            mismatch.append(command)
+    return mismatch
+
+
+# commands in the quoting styles xcode emits, used to verify split_fast
+samples = [
+    "/Applications/Xcode.app/Contents/Developer/Toolchains/XcodeDefault.xctoolchain/usr/bin/swiftc -module-name App -Onone -enforce-exclusivity\\=checked @/Users/a/Library/Developer/Xcode/DerivedData/App-abc/Build/Intermediates.noindex/App.build/Debug-iphonesimulator/App.build/Objects-normal/arm64/App.SwiftFileList -DDEBUG -sdk /Applications/Xcode.app/Contents/Developer/Platforms/iPhoneSimulator.platform/Developer/SDKs/iPhoneSimulator17.0.sdk -target arm64-apple-ios13.0-simulator -g -module-cache-path /Users/a/Library/Developer/Xcode/DerivedData/ModuleCache.noindex -Xfrontend -serialize-debugging-options -swift-version 5 -I /Users/a/Build/Products/Debug-iphonesimulator -F /Users/a/Build/Products/Debug-iphonesimulator -c -j8 -index-store-path /Users/a/Library/Developer/Xcode/DerivedData/App-abc/Index.noindex/DataStore -Xcc -I/Users/a/App/App.build/swift-overrides.hmap -Xcc -iquote -Xcc /Users/a/App.build/App-generated-files.hmap -Xcc -DDEBUG\\=1 -emit-objc-header -emit-objc-header-path /Users/a/App.build/App-Swift.h -working-directory /Users/a/App",
+    "/Applications/Xcode.app/Contents/Developer/Toolchains/XcodeDefault.xctoolchain/usr/bin/clang -x objective-c -target arm64-apple-ios13.0-simulator -fmessage-length\\=0 -fdiagnostics-show-note-include-stack -std\\=gnu11 -fobjc-arc -fmodules -gmodules \"-fmodules-cache-path=/Users/a/Library/Developer/Xcode/DerivedData/ModuleCache.noindex\" -DDEBUG\\=1 -DCOCOAPODS\\=1 '-DPOD_CONFIGURATION_DEBUG=1' -isysroot /Applications/Xcode.app/Contents/Developer/Platforms/iPhoneSimulator.platform/Developer/SDKs/iPhoneSimulator17.0.sdk -I/Users/a/Pods/Headers/Public -I/Users/a/Pods/Headers/Public/AFNetworking -include /Users/a/Pods/Target\\ Support\\ Files/AFNetworking/AFNetworking-prefix.pch -MMD -MT dependencies -MF /Users/a/AFNetworking.build/Objects-normal/arm64/AFHTTPSessionManager.d --serialize-diagnostics /Users/a/AFNetworking.build/Objects-normal/arm64/AFHTTPSessionManager.dia -c /Users/a/Pods/AFNetworking/AFNetworking/AFHTTPSessionManager.m -o /Users/a/AFNetworking.build/Objects-normal/arm64/AFHTTPSessionManager.o -index-unit-output-path /Pods.build/Debug-iphonesimulator/AFNetworking.build/Objects-normal/arm64/AFHTTPSessionManager.o",
+    "clang -DNAME=\\\"value\\\" -DQUOTED=\"a \\\"b\\\" c\" -DPATH=\"C:\\\\dir\" -DTAB=\"a\\tb\" '-DSINGLE=\\n' -I\"/path with space\"/include x\\ y.m",
+    "swiftc '' \"\" a''b a\"\"b -Xcc \"-DA=\\$B\" -Xcc '-DC=\"d\"' -D\\ E \\# -o out",
+    "cd /Users/a/My\\ Project",
+    "CompileC /Users/a/Build/x.o /Users/a/My\\ Project/x.m normal arm64 objective-c com.apple.compilers.llvm.clang.1_0.compiler (in target 'App' from project 'App')",
+    "ProcessPCH++ /Users/a/SharedPrecompiledHeaders/App-Prefix.pch.gch /Users/a/App/App-Prefix.pch normal arm64 objective-c++ com.apple.compilers.llvm.clang.1_0.compiler",
+    "  leading\tand\rtrailing\nwhitespace  ",
+    "unicode \u00e9\u4e2d\u6587 \"\u00e9 \u00e9\" caf\u00e9\\ bar \u00a0nbsp",
+    "unclosed 'quote",
+    'unclosed "quote',
+    "trailing escape\\",
+    "",
+]
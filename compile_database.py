@@ -1,9 +1,11 @@
 from collections import defaultdict
+from collections.abc import Mapping
 import logging
 import os
 import re
 import subprocess
-from typing import Dict, List, Optional
+from threading import Lock, RLock
+from typing import Dict, List, Optional, Tuple
 
 
 globalStore = {}
@@ -27,7 +29,7 @@ def getXcodeBasePath():
             XCODE_BASE_PATH = subprocess.check_output(
                 ["xcode-select", "-p"]
             ).rstrip().decode('utf8')
-        except subprocess.CalledProcessError:
+        except (subprocess.CalledProcessError, OSError):
             XCODE_BASE_PATH = '/Applications/Xcode.app/Contents/Developer'
     return XCODE_BASE_PATH
 
@@ -70,68 +72,56 @@ def additionalFlags(flagsPath):
     return []
 
 
-def findAllHeaderDirectory(rootDirectory, store):
-    headerDirsCacheDict = store.setdefault("headerDirs", {})
-    headerDirs = headerDirsCacheDict.get(rootDirectory)
-    if headerDirs:
-        return headerDirs
-
-    output = subprocess.check_output(
-        ["find", "-L", rootDirectory, "-name", "*.h"], universal_newlines=True
-    )
-    headers = output.splitlines()
-    headerDirs = set()
-    frameworks = set()
-    for h in headers:
-        frameworkIndex = h.rfind(".framework")
-        if frameworkIndex != -1:
-            h = os.path.dirname(h[:frameworkIndex])
-            frameworks.add(h)
-        else:
-            h = os.path.dirname(h)
-            headerDirs.add(h)
-            # contains more one dir for import with module name
-            # don't contains more one module name dir. if need, can specify in .flags
-            # conflict with #if_include framework check
-            #  h = os.path.dirname(h)
-            #  headerDirs.add(h)
-
-    headerDirsCacheDict[rootDirectory] = (headerDirs, frameworks)
-    return headerDirs, frameworks
-
-
-def findAllSwiftFiles(rootDirectory):
-    output = subprocess.check_output(
-        ["find", "-H", rootDirectory, "-name", "*.swift"], universal_newlines=True
-    )
-    return [os.path.realpath(l) for l in output.splitlines()]
+def directoryIndex(rootDirectory, store, check=False):
+    """
+    shared index of header and swift files under rootDirectory.
+    :param check: check all indexed directories for changes now, instead of wait periodical refresh by server
+    """
+    from dir_index import DirectoryIndex
+
+    indexes = store.setdefault("dirIndex", {})
+    if (index := indexes.get(rootDirectory)) is None:
+        index_path = None
+        if cache_path := store.get("cache_path"):
+            from misc import cache_file_path
+
+            index_path = cache_file_path(cache_path, "dir_index", rootDirectory)
+        index = indexes.setdefault(rootDirectory, DirectoryIndex(rootDirectory, index_path))
+    if index.refreshed_at is None:
+        index.refresh()
+    elif check:
+        index.check()
+    return index
+
+
+def refreshDirectoryIndexes(store: Dict) -> List[str]:
+    """rescan directory indexes in store, return roots changed since last call. inferred flags are dropped then"""
+    roots = []
+    for root, index in list(store.get("dirIndex", {}).items()):
+        index.refresh()
+        if index.take_changes():
+            roots.append(root)
+    if roots:
+        store.pop("inferFlags", None)
+    return roots
 
 
 def cmd_split(s):
-    import shlex
+    from cmd_splitter import cmd_split
 
-    return shlex.split(s)  # shlex is more right
-    # shlex.split is slow, use a simple version, only consider most case
-    # def extract(m):
-    #     if m.lastindex == 3:  # \ escape version. remove it
-    #         return m.group(m.lastindex).replace("\\ ", " ")
-    #     return m.group(m.lastindex)
-
-    # return [extract(m) for m in cmd_split_pattern.finditer(s)]
+    return cmd_split(s)  # fast split with shlex fallback, memoized by command
 
 
 def readFileArgs(path):
+    from cmd_splitter import split
+
     with open(path) as f:
-        return cmd_split(f.read())
+        return split(f.read())  # file content is unique, no need to memoize
 
 
 # Use file content as command line arguments, will perform shell word splitting
-def getFileArgs(path, cache) -> List[str]:
-    files = cache.get(path)
-    if files is None:
-        files = readFileArgs(path)
-        cache[path] = files
-    return files
+def getFileArgs(path, cache: "FileListCache") -> List[str]:
+    return cache.read(path)
 
 
 def filterFlags(items, fileCache):
@@ -173,13 +163,134 @@ def filterFlags(items, fileCache):
         pass
 
 
-def findSwiftModuleRoot(filename):
-    """return project root or None. if not found"""
-    filename = os.path.abspath(filename)
-    directory = os.path.dirname(filename)
+class FlagsCache:
+    """LRU cache of {command: filtered flags}. bounded by entries count and total args length"""
+
+    def __init__(self, max_entries=64, max_size=32 << 20):
+        from collections import OrderedDict
+
+        self.lock = Lock()
+        self.data = OrderedDict()
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def sizeof(flags):
+        return sum(map(len, flags))
+
+    def get(self, command) -> Optional[tuple]:
+        with self.lock:
+            flags = self.data.get(command)
+            if flags is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.data.move_to_end(command)
+            return flags
+
+    def put(self, command, flags: tuple):
+        with self.lock:
+            if command in self.data:
+                self.size -= self.sizeof(self.data.pop(command))
+            self.data[command] = flags
+            self.size += self.sizeof(flags)
+            # keep at least the newest one
+            while len(self.data) > 1 and (
+                len(self.data) > self.max_entries or self.size > self.max_size
+            ):
+                _, evicted = self.data.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.data),
+            "size": self.size,
+        }
+
+
+class FileListCache(FlagsCache):
+    """
+    LRU cache of {filelist path: (stat, args)}, bounded by total args length.
+    entry is validated by mtime and size, so it can be shared by stores and survive reload
+    """
+
+    def __init__(self, max_entries=1 << 16, max_size=64 << 20):
+        super().__init__(max_entries, max_size)
+
+    @staticmethod
+    def sizeof(entry):
+        return sum(map(len, entry[1]))
+
+    def read(self, path) -> List[str]:
+        """args in file, raise OSError if can't read"""
+        stat = fileStat(path)
+        with self.lock:
+            entry = self.data.get(path)
+            if entry is not None and entry[0] == stat:
+                self.hits += 1
+                self.data.move_to_end(path)
+                return entry[1]
+            self.misses += 1
+
+        from cmd_splitter import split
+
+        with open(path) as f:
+            st = os.fstat(f.fileno())  # stat of read content
+            files = split(f.read())
+        self.put(path, ((st.st_mtime_ns, st.st_size), files))
+        return files
+
+    def prefetch(self, paths, workers=8):
+        """read paths in parallel, big project may have thousands of filelists"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def read(path):
+            try:
+                self.read(path)
+            except OSError:
+                pass
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="filelist") as pool:
+            for _ in pool.map(read, paths):
+                pass
+
+
+globalFileListCache = FileListCache()
+# prefetch filelists in parallel when a compile file has more than this
+PREFETCH_FILELISTS = 64
+
+
+def fileListCacheFromStore(store: Dict) -> FileListCache:
+    """filelist cache is validated by stat, so stores share the global one by default"""
+    return store.get("filelist") or store.setdefault("filelist", globalFileListCache)
+
+
+def findSwiftModuleRoot(filename, store=None):
+    """return project root or None. if not found. result is cached per directory when store given"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    if store is None:
+        return _findSwiftModuleRoot(directory, {})
+
+    # {dir: (result, {probed dir: mtime})}. create or delete marker files changes the probed dir mtime
+    cache = store.setdefault("moduleRoot", {})
+    if (entry := cache.get(directory)) and mtimesUnchanged(entry[1]):
+        return entry[0]
+    probed = {}
+    result = _findSwiftModuleRoot(directory, probed)
+    cache[directory] = (result, probed)
+    return result
+
+
+def _findSwiftModuleRoot(directory, probed):
     flagFile = None
     compileFile = None
     while directory and directory != "/":
+        probed[directory] = dirMtime(directory)  # before probe, so change after it will be seen
         p = os.path.join(directory, ".swiftflags")
         if os.path.isfile(p):
             return (
@@ -203,145 +314,648 @@ def findSwiftModuleRoot(filename):
     return (directory, flagFile, compileFile)
 
 
+def dirMtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def mtimesUnchanged(mtimes: Dict[str, Optional[int]]) -> bool:
+    return all(dirMtime(d) == m for d, m in mtimes.items())
+
+
 def filekey(filename):
     return os.path.realpath(filename).lower()
 
 
+# bump when CompileFileInfo index content changes
+INDEX_VERSION = 3
+
+
+def compileFileIndexPath(compileFile, cache_path):
+    from misc import cache_file_path
+
+    return cache_file_path(cache_path, "compile_index", compileFile)
+
+
+def fileStat(path):
+    """(mtime_ns, size), or None if not exists"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def compileFileKey(compileFile):
+    """(mtime_ns, size, md5) of compileFile content, and stat of its journal"""
+    import hashlib
+    from xclog_parser import database_journal_path
+
+    h = hashlib.md5()
+    with open(compileFile, "rb") as f:
+        stat = os.fstat(f.fileno())
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    journal = fileStat(database_journal_path(compileFile))
+    return (stat.st_mtime_ns, stat.st_size, h.hexdigest(), journal)
+
+
 class CompileFileInfo:
     def __init__(self, compileFile, store):
+        self.compileFile = compileFile
         self.file_info = {}  # {file: command}
-        self.dir_info = None  # {dir: set[file key]}
+        self.swift_dirs = None  # {dir: a swift file key in it}
         self.cmd_info = None  # {cmd: set[file key]}
+        self.project_roots = {}  # {dir: isProjectRoot}, memo for new_file
         self.workspace_dir_info = {}
-
-        # load compileFile into info
-        import json
-
-        with open(compileFile) as f:
-            m: List[dict] = json.load(f)
-            for i in m:
-                command = i.get("command")
-                if not command:
+        self.added_files = {}  # {file: target name}, added by new_file
+        # new files overlay. file_info of new file is the base command, the full command is built lazily
+        self.extra_files: Dict[str, List[str]] = {}  # {base command: new files}
+        self.extended_commands: Dict[str, str] = {}  # {base command: command with new files}
+        self.overlay_version = 0  # increase when new files added
+        self.targets_cache = None  # (overlay version, targets with new files)
+        self.module_targets = {}  # {target name: files}
+        self.untargeted_files = []  # files without target name
+        self.module_graph = {}  # {module name: dependency names}
+
+        # warm start from persistent index in cache dir, which is keyed by compileFile stat and hash
+        index_path = None
+        if cache_path := store.get("cache_path"):
+            index_path = compileFileIndexPath(compileFile, cache_path)
+            key = compileFileKey(compileFile)
+            if self.load_index(index_path, key):
+                logging.debug(f"load compile file index from {index_path}")
+                return
+
+        usedFileLists = self.load(compileFile, store)
+
+        if index_path:
+            self.save_index(index_path, key, usedFileLists)
+
+    def load(self, compileFile, store) -> set[str]:
+        """load compileFile into info, return used filelist paths"""
+        from xclog_parser import load_database_file, module_dependencies
+
+        usedFileLists = set()
+        cache = fileListCacheFromStore(store)
+        m: List[dict] = load_database_file(compileFile)
+        allFileLists = [l for i in m if i.get("command") for l in i.get("fileLists") or ()]
+        if len(allFileLists) > PREFETCH_FILELISTS:
+            cache.prefetch(allFileLists)
+        targets = defaultdict(dict)  # dict as ordered set
+        untargeted = {}
+        for i in m:
+            command = i.get("command")
+            if not command:
+                continue
+            name = i.get("module_name") or targetNameForCommand(command)
+            target_files = targets[name] if name else untargeted
+            if files := i.get("files"):  # batch files, eg: swift module
+                self.file_info.update((filekey(f), command) for f in files)
+                target_files.update(dict.fromkeys(files))
+            # file list store in a dedicated file
+            for l in i.get("fileLists") or ():
+                try:
+                    files = cache.read(l)
+                except OSError:
                     continue
-                if files := i.get("files"):  # batch files, eg: swift module
-                    self.file_info.update((filekey(f), command) for f in files)
-                if fileLists := i.get(
-                    "fileLists"
-                ):  # file list store in a dedicated file
-                    self.file_info.update(
-                        (filekey(f), command)
-                        for l in fileLists
-                        if os.path.isfile(l)
-                        for f in getFileArgs(l, store.setdefault("filelist", {}))
-                    )
-                    if "directory" in i:
-                        self.workspace_dir_info.update(
-                            (filekey(f), i.get("directory"))
-                            for l in fileLists
-                            if os.path.isfile(l)
-                            for f in getFileArgs(l, store.setdefault("filelist", {}))
-                        )
-                if file := i.get("file"):  # single file info
-                    self.file_info[filekey(file)] = command
-                    if "directory" in i:
-                        self.workspace_dir_info[filekey(file)] = i.get("directory")
+                keys = [filekey(f) for f in files]
+                usedFileLists.add(l)
+                self.file_info.update((k, command) for k in keys)
+                if "directory" in i:
+                    self.workspace_dir_info.update((k, i.get("directory")) for k in keys)
+                target_files.update(dict.fromkeys(files))
+            if file := i.get("file"):  # single file info
+                self.file_info[filekey(file)] = command
+                if "directory" in i:
+                    self.workspace_dir_info[filekey(file)] = i.get("directory")
+                target_files[file] = None
+        self.module_targets = {name: list(files) for name, files in targets.items()}
+        self.untargeted_files = list(untargeted)
+        self.module_graph = module_dependencies(m)
+        return usedFileLists
+
+    def load_index(self, index_path, key) -> bool:
+        """return True if index is valid and loaded"""
+        import pickle
+
+        try:
+            with open(index_path, "rb") as f:
+                header = pickle.load(f)
+                if header.get("version") != INDEX_VERSION or header.get("key") != key:
+                    return False
+                # filelist content is also indexed, should be unchanged
+                if any(fileStat(p) != stat for p, stat in header["filelists"].items()):
+                    return False
+                (
+                    self.file_info,
+                    self.workspace_dir_info,
+                    self.module_targets,
+                    self.untargeted_files,
+                    self.module_graph,
+                ) = pickle.load(f)
+                return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning(f"invalid compile file index {index_path}: {e}")
+            return False
+
+    def save_index(self, index_path, key, fileLists):
+        from misc import dump_pickle
+
+        header = {
+            "version": INDEX_VERSION,
+            "key": key,
+            "filelists": {p: fileStat(p) for p in fileLists},
+        }
+        data = (
+            self.file_info,
+            self.workspace_dir_info,
+            self.module_targets,
+            self.untargeted_files,
+            self.module_graph,
+        )
+        try:
+            dump_pickle(index_path, header, data)
+        except OSError as e:
+            logging.warning(f"save compile file index failed: {e}")
 
     def get(self, filename):
         if command := self.file_info.get(filename.lower()):
+            if command in self.extra_files:
+                command = self.extended_command(command)
             # xcode 12 escape =, but not recognized...
             return command.replace("\\=", "=")
 
+    def get_overlay(self, filename) -> Optional[Tuple[str, List[str]]]:
+        """(base command, new files inserted into it), so base command can be split once"""
+        if command := self.file_info.get(filename.lower()):
+            return command.replace("\\=", "="), self.extra_files.get(command, [])
+        return None
+
+    def extended_command(self, command):
+        if (extended := self.extended_commands.get(command)) is None:
+            extended = insertFilesIntoCommand(command, self.extra_files[command])
+            self.extended_commands[command] = extended
+        return extended
+
     def get_working_directory(self, filename):
         return self.workspace_dir_info.get(filekey(filename))
 
-    def groupby_dir(self) -> dict[str, set[str]]:
-        if self.dir_info is None:  # lazy index dir and cmd
-            self.dir_info = defaultdict(set)
+    def swift_file_in_dir(self, dir) -> Optional[str]:
+        if self.swift_dirs is None:  # lazy index, built once
+            self.swift_dirs = {}
+            for f in self.file_info:
+                if f.endswith(".swift"):
+                    self.swift_dirs.setdefault(os.path.dirname(f), f)
+        return self.swift_dirs.get(dir)
+
+    def groupby_cmd(self) -> dict[str, set[str]]:
+        if self.cmd_info is None:  # lazy index cmd
             self.cmd_info = defaultdict(set)
             for f, cmd in self.file_info.items():
-                self.dir_info[os.path.dirname(f)].add(f)
                 self.cmd_info[cmd].add(f)
+        return self.cmd_info
 
-        return self.dir_info
+    def files_under(self, prefix):
+        """yield (file key, command) for file key start with prefix"""
+        for file, command in list(self.file_info.items()):  # may change by new_file in other thread
+            if file.startswith(prefix):
+                yield file, command
 
     # hack new file into current compile file
     # return: set of filekey for match for file. or None if new_file can't be infered
     def new_file(self, filename):
-        # Currently only processing swift files
-        if not filename.endswith(".swift"):
-            return
-
-        if os.path.basename(filename) == "Package.swift":
-            return  # special case for Package.swift, handled in InferFlagsForSwift
-        filename = os.path.realpath(filename)
-        filename_key = filename.lower()
-        if filename_key in self.file_info:
-            return {filename_key}  # already handled
-
-        dir = os.path.dirname(filename_key)
-
-        # 1. First look for existing swift files in the current directory
-        similar_compiled_file = next(
-            (v for v in self.groupby_dir().get(
-                dir, ()) if v.endswith(".swift")), None
+        return self.new_files([filename]).get(filename)
+
+    def new_files(self, filenames) -> Dict[str, set[str]]:
+        """
+        batch new_file, new files are added to the module overlay without rebuild module command.
+        return {filename: module file keys} for handled files
+        """
+        result = {}
+        names = {}  # {command: target name}, commands are long, search once
+        for filename in filenames:
+            if not isNewFileCandidate(filename):
+                continue
+            path = os.path.realpath(filename)
+            filename_key = path.lower()
+            if filename_key in self.file_info:
+                result[filename] = {filename_key}  # already handled
+                continue
+
+            dir = os.path.dirname(filename_key)
+            similar_compiled_file = findSimilarSwiftFile(dir, self.swift_file_in_dir, self.project_roots)
+            if not similar_compiled_file:
+                continue
+
+            logging.info(
+                f"Found new file: {path} with similar_compiled_file: {similar_compiled_file}")
+
+            command = self.file_info[similar_compiled_file]
+            if not next(cmd_split_pattern.finditer(command), None):
+                continue  # invalid command
+
+            # update command info
+            self.extra_files.setdefault(command, []).append(path)
+            self.extended_commands.pop(command, None)
+            self.file_info[filename_key] = command
+            if workspace_dir := self.workspace_dir_info.get(similar_compiled_file):
+                self.workspace_dir_info[filename_key] = workspace_dir
+            self.swift_dirs.setdefault(dir, filename_key)
+            module_files = self.groupby_cmd()[command]
+            module_files.add(filename_key)
+            if command not in names:
+                names[command] = targetNameForCommand(command)
+            self.added_files[path] = names[command]
+            self.overlay_version += 1
+            result[filename] = module_files
+        return result
+
+    def targets(self, store, load=True) -> Optional[Dict[str, List[str]]]:
+        """{target name: source files}, built with file info"""
+        if self.targets_cache is None or self.targets_cache[0] != self.overlay_version:
+            self.targets_cache = (self.overlay_version, withAddedFiles(self.module_targets, self.added_files))
+        return self.targets_cache[1]
+
+    def fallback_files(self, store) -> List[str]:
+        """files without target name"""
+        return self.untargeted_files
+
+
+# clang output path contains target name, eg: .../App.build/Objects-normal/arm64/x.o
+objects_normal_pattern = re.compile(r"/([^/\s]+)\.build/Objects-normal/")
+module_name_pattern = re.compile(r"-module-name\s+(\S+)")
+
+
+def targetNameForCommand(command) -> Optional[str]:
+    """swift module name, or xcode target name for clang command"""
+    if m := module_name_pattern.search(command):
+        return m.group(1)
+    if m := objects_normal_pattern.search(command):
+        return m.group(1)
+    return None
+
+
+def itemFiles(item, store):
+    """yield source files of a database item"""
+    yield from item.get("files") or ()
+    for l in item.get("fileLists") or ():
+        try:
+            yield from getFileArgs(l, fileListCacheFromStore(store))
+        except OSError:
+            pass
+    if file := item.get("file"):
+        yield file
+
+
+class LazyTargets(Mapping):
+    """{target name: source files}, files are got by files_of(name) when accessed"""
+
+    def __init__(self, names: List[str], files_of):
+        self.names = dict.fromkeys(names)
+        self.files_of = files_of
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        return self.files_of(name)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def withAddedFiles(targets: Dict[str, List[str]], added_files: Dict[str, Optional[str]]):
+    """new targets with {file: target name} added, each target list is built once"""
+    if not added_files:
+        return targets
+    added = defaultdict(dict)  # {target name: files}, dict as ordered set
+    for file, name in added_files.items():
+        if name:
+            added[name][file] = None
+    targets = dict(targets)
+    for name, files in added.items():
+        targets[name] = targets.get(name, []) + list(files)
+    return targets
+
+
+def isNewFileCandidate(filename):
+    # Currently only processing swift files
+    if not filename.endswith(".swift"):
+        return False
+    if os.path.basename(filename) == "Package.swift":
+        return False  # special case for Package.swift, handled in InferFlagsForSwift
+    return True
+
+
+def findSimilarSwiftFile(dir, swift_file_in_dir, project_roots=None):
+    """
+    return a compiled swift file key in dir or its nearest ancestor, stop at project root. or None
+    :param swift_file_in_dir: func(dir) -> a compiled swift file key in dir, or None
+    :param project_roots: memo of {dir: isProjectRoot}
+    """
+    # look up the index upward first, so project root is only probed when a file is found above
+    similar_compiled_file = swift_file_in_dir(dir)
+    skipped = []  # ancestors without swift file
+    current_dir = dir
+    while not similar_compiled_file and current_dir and current_dir != "/":
+        current_dir = os.path.dirname(current_dir)
+        if not (similar_compiled_file := swift_file_in_dir(current_dir)):
+            skipped.append(current_dir)
+    if not similar_compiled_file:
+        return None
+
+    # if passed project root, stop searching
+    if project_roots is None:
+        project_roots = {}
+    for d in skipped:
+        if (is_root := project_roots.get(d)) is None:
+            is_root = project_roots[d] = isProjectRoot(d)
+        if is_root:
+            return None
+    return similar_compiled_file
+
+
+def insertFilesIntoCommand(command, filenames):
+    """insert filenames after executable, return None if command is invalid"""
+    cmd_match = next(cmd_split_pattern.finditer(command), None)
+    if not cmd_match:
+        return None
+    index = cmd_match.end()
+    from shlex import quote
+
+    return "".join((command[:index], *(" " + quote(f) for f in reversed(filenames)), command[index:]))
+
+
+def isSqliteDatabase(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+    except OSError:
+        return False
+
+
+class SqliteCompileFileInfo:
+    """
+    compile info backed by sqlite database which written by xclog_parser --sqlite.
+    query on demand instead of load all files into memory.
+    """
+
+    def __init__(self, compileFile, store):
+        import sqlite3
+        from threading import Lock
+        from urllib.parse import quote
+
+        self.conn = sqlite3.connect(
+            f"file:{quote(compileFile)}?mode=ro", uri=True, check_same_thread=False
         )
+        self.lock = Lock()
+        # new_file hack is keeped in memory
+        self.extra_files = {}  # {command_id: new files}
+        self.overrides = {}  # {command_id: command with new files}, built lazily
+        self.new_file_info = {}  # {file key: (command_id, directory)}
+        self.new_swift_dirs = {}  # {dir: a new file key in it}
+        self.project_roots = {}
+        self.added_files = {}  # {file: target name}
+        self.target_commands = None  # {target name: command ids of items without module_name}, lazy load
+        self.module_graph = {}
+
+    def query(self, sql, *args):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def lookup(self, key):
+        """return (command_id, directory) for file key, or None"""
+        if v := self.new_file_info.get(key):
+            return v
+        rows = self.query(
+            "SELECT items.command_id, files.directory FROM files JOIN items ON files.item = items.seq"
+            " WHERE files.key = ?",
+            key,
+        )
+        return rows[0] if rows else None
 
-        # 2. If not found in current directory, search upward through parent directories until project root
-        if not similar_compiled_file:
-            current_dir = dir
-            while current_dir and current_dir != "/":
-                parent_dir = os.path.dirname(current_dir)
+    def command(self, command_id):
+        if command := self.overrides.get(command_id):
+            return command
+        rows = self.query("SELECT command FROM commands WHERE id = ?", command_id)
+        command = rows[0][0] if rows else None
+        if command and (extra := self.extra_files.get(command_id)):
+            command = self.overrides[command_id] = insertFilesIntoCommand(command, extra)
+        return command
 
-                # Look for swift files in parent directory
-                similar_compiled_file = next(
-                    (v for v in self.groupby_dir().get(
-                        parent_dir, ()) if v.endswith(".swift")), None
-                )
-                if similar_compiled_file:
-                    break
+    def get(self, filename):
+        if (v := self.lookup(filename.lower())) and (command := self.command(v[0])):
+            # xcode 12 escape =, but not recognized...
+            return command.replace("\\=", "=")
 
-                # If reached project root, stop searching
-                if isProjectRoot(parent_dir):
-                    break
+    def get_overlay(self, filename) -> Optional[Tuple[str, List[str]]]:
+        """same as CompileFileInfo.get_overlay"""
+        if not (v := self.lookup(filename.lower())):
+            return None
+        rows = self.query("SELECT command FROM commands WHERE id = ?", v[0])
+        if not rows:
+            return None
+        return rows[0][0].replace("\\=", "="), self.extra_files.get(v[0], [])
 
-                current_dir = parent_dir
+    def get_working_directory(self, filename):
+        if v := self.lookup(filekey(filename)):
+            return v[1]
+
+    def files_under(self, prefix):
+        """yield (file key, command) for file key start with prefix"""
+        rows = self.query(
+            "SELECT files.key, items.command_id FROM files JOIN items ON files.item = items.seq"
+            " WHERE files.key >= ? AND files.key < ?",
+            prefix,
+            prefix + "\uffff",
+        )
+        for file, command_id in rows:
+            if command := self.command(command_id):
+                yield file, command
 
-        if not similar_compiled_file:
-            return
+    def new_file(self, filename):
+        """same as CompileFileInfo.new_file"""
+        return self.new_files([filename]).get(filename)
 
-        logging.info(
-            f"Found new file: {filename} with similar_compiled_file: {similar_compiled_file}")
+    def new_files(self, filenames) -> Dict[str, set[str]]:
+        """same as CompileFileInfo.new_files"""
 
-        command = self.file_info[similar_compiled_file]
+        def swift_file_in_dir(d):
+            rows = self.query(
+                "SELECT key FROM files WHERE dir = ? AND key LIKE '%.swift' LIMIT 1", d
+            )
+            if rows:
+                return rows[0][0]
+            return self.new_swift_dirs.get(d)
+
+        result = {}
+        added = defaultdict(list)  # {command_id: filenames}
+        for filename in filenames:
+            if not isNewFileCandidate(filename):
+                continue
+            path = os.path.realpath(filename)
+            filename_key = path.lower()
+            if self.lookup(filename_key):
+                result[filename] = {filename_key}  # already handled
+                continue
 
-        cmd_match = next(cmd_split_pattern.finditer(command), None)
-        if not cmd_match:
-            return
-        assert self.cmd_info  # init in groupby_dir
-        module_files = self.cmd_info.pop(command)
-        index = cmd_match.end()
-        from shlex import quote
+            similar_compiled_file = findSimilarSwiftFile(
+                os.path.dirname(filename_key), swift_file_in_dir, self.project_roots
+            )
+            if not similar_compiled_file:
+                continue
 
-        command = "".join(
-            (command[:index], " ", quote(filename), command[index:]))
+            logging.info(
+                f"Found new file: {path} with similar_compiled_file: {similar_compiled_file}")
 
-        workspace_dir = self.workspace_dir_info[similar_compiled_file]
+            command_id, workspace_dir = self.lookup(similar_compiled_file)
+            command = self.command(command_id)
+            if not command or not next(cmd_split_pattern.finditer(command), None):
+                continue
+
+            self.extra_files.setdefault(command_id, []).append(path)
+            self.overrides.pop(command_id, None)
+            self.new_file_info[filename_key] = (command_id, workspace_dir)
+            self.new_swift_dirs.setdefault(os.path.dirname(filename_key), filename_key)
+            self.added_files[path] = targetNameForCommand(command)
+            added[command_id].append(filename)
+
+        # module files are queried once per module
+        for command_id, module_filenames in added.items():
+            module_files = {
+                k
+                for (k,) in self.query(
+                    "SELECT files.key FROM files JOIN items ON files.item = items.seq"
+                    " WHERE items.command_id = ?",
+                    command_id,
+                )
+            }
+            module_files.update(k for k, v in self.new_file_info.items() if v[0] == command_id)
+            result.update((f, module_files) for f in module_filenames)
+        return result
+
+    def targets(self, store, load=True) -> Optional["LazyTargets"]:
+        """
+        same as CompileFileInfo.targets, but files are queried per target when accessed,
+        so memory stays flat for big database. return None if not loaded and load is False
+        """
+        if self.target_commands is None:
+            if not load:
+                return None
+            import json
+            from xclog_parser import module_dependencies
+
+            target_commands = defaultdict(list)
+            for (name,) in self.query("SELECT DISTINCT module_name FROM items WHERE module_name IS NOT NULL"):
+                target_commands[name]
+            # clang items have no module_name, their target name is in command
+            with self.lock:
+                cursor = self.conn.execute(
+                    "SELECT id, command FROM commands WHERE id IN"
+                    " (SELECT command_id FROM items WHERE module_name IS NULL)"
+                )
+                for command_id, command in cursor:
+                    target_commands[targetNameForCommand(command)].append(command_id)
+            # only imports of module items are needed, not their files
+            rows = self.query(
+                "SELECT module_name, json_extract(data, '$.imports') FROM items WHERE module_name IS NOT NULL"
+            )
+            self.module_graph = module_dependencies(
+                [{"module_name": name, "imports": json.loads(imports or "[]")} for name, imports in rows]
+            )
+            self.target_commands = target_commands
+        names = [name for name in self.target_commands if name]
+        return LazyTargets(names, lambda name: self.target_files(name, store))
+
+    def target_files(self, name, store) -> List[str]:
+        """files of target name, None name for files without target"""
+        import json
+
+        rows = []
+        if name:
+            rows += self.query("SELECT seq, data FROM items WHERE module_name = ?", name)
+        command_ids = self.target_commands.get(name) or []
+        for i in range(0, len(command_ids), 500):  # keep under sqlite variables limit
+            chunk = command_ids[i : i + 500]
+            rows += self.query(
+                "SELECT seq, data FROM items WHERE module_name IS NULL AND command_id IN (%s)"
+                % ",".join("?" * len(chunk)),
+                *chunk,
+            )
+        rows.sort()
+        files = {}
+        for _, data in rows:
+            files.update(dict.fromkeys(itemFiles(json.loads(data), store)))
+        files.update((file, None) for file, n in self.added_files.items() if n == name)
+        return list(files)
+
+    def fallback_files(self, store) -> List[str]:
+        """same as CompileFileInfo.fallback_files"""
+        self.targets(store)
+        return self.target_files(None, store)
 
-        # update command info
-        self.groupby_dir()[dir].add(filename_key)
-        module_files.add(filename_key)
-        self.cmd_info[command] = module_files
-        for v in module_files:
-            self.file_info[v] = command
-            self.workspace_dir_info[v] = workspace_dir
-        return module_files
+
+def storeLock(store: Dict) -> RLock:
+    """lock to serialize load and modify compile info in store, when requests are concurrent"""
+    return store.get("lock") or store.setdefault("lock", RLock())
 
 
 def newfileForCompileFile(filename, compileFile, store) -> Optional[set[str]]:
     if not compileFile:
         return None
     info = compileFileInfoFromStore(compileFile, store)
-    return info.new_file(filename)
+    with storeLock(store):
+        return info.new_file(filename)
+
+
+def targetsForCompileFile(compileFile, store, load=True) -> Optional[Dict[str, List[str]]]:
+    """
+    {target name: source files} grouped by module. files keep the case in database.
+    :param load: if False, return None when targets not loaded yet
+    """
+    if not compileFile:
+        return {}
+    if load:
+        info = compileFileInfoFromStore(compileFile, store)
+    elif (info := loadedCompileFileInfo(compileFile, store)) is None:
+        return None
+    with storeLock(store):
+        return info.targets(store, load)
+
+
+def fallbackFilesForCompileFile(compileFile, store) -> List[str]:
+    """files in compile file but not in any target"""
+    if not compileFile:
+        return []
+    info = compileFileInfoFromStore(compileFile, store)
+    with storeLock(store):
+        return info.fallback_files(store)
+
+
+def targetDependenciesForCompileFile(compileFile, store) -> Dict[str, List[str]]:
+    """{module name: dependency module names}"""
+    if not compileFile:
+        return {}
+    info = compileFileInfoFromStore(compileFile, store)
+    with storeLock(store):
+        info.targets(store)
+        return info.module_graph
+
+
+def targetNamesForFiles(keys, *infos) -> Dict[str, Optional[str]]:
+    """{file key: target name} by command in the first info which has the file"""
+    names = {}
+    for key in keys:
+        command = next((c for info in infos if info and (c := info.get(key))), None)
+        names[key] = command and targetNameForCommand(command)
+    return names
 
 
 def commandForFile(filename, compileFile, store: Dict):
@@ -354,26 +968,83 @@ def commandForFile(filename, compileFile, store: Dict):
 
 
 def compileFileInfoFromStore(compileFile, store: Dict):
+    compile_store = store.setdefault("compile", {})
+    info: CompileFileInfo = compile_store.get(compileFile)
+    if info is not None:
+        return info
+    with storeLock(store):  # other thread wait the loading one, instead of load again
+        return _compileFileInfoFromStore(compileFile, store)
+
+
+def _compileFileInfoFromStore(compileFile, store: Dict):
     compile_store = store.setdefault("compile", {})
     info: CompileFileInfo = compile_store.get(compileFile)
     if info is None:  # load {filename.lower: command} dict
         # cache first to avoid re enter when error
-        info = CompileFileInfo(compileFile, store)
+        if isSqliteDatabase(compileFile):
+            info = SqliteCompileFileInfo(compileFile, store)
+        else:
+            info = CompileFileInfo(compileFile, store)
         compile_store[compileFile] = info
 
-        # if has additional new_file, generate command for it
-        for file in store.get("additional_files") or ():
-            info.new_file(file)
+        # if has additional new_file, generate command for them in one pass
+        if additional_files := store.get("additional_files"):
+            info.new_files(additional_files)
     return info
 
 
+def loadedCompileFileInfo(compileFile, store: Dict):
+    """return compile info if already loaded, won't trigger loading"""
+    return store.get("compile", {}).get(compileFile)
+
+
+def diffCompileFileInfo(old, new) -> Optional[set[str]]:
+    """
+    return file keys whose command or working directory changed(include added and removed).
+    None info means no compile file. return None if can't diff, eg: sqlite info
+    """
+    maps = []
+    for info in (old, new):
+        if info is None:
+            maps.append(({}, {}))
+        elif isinstance(info, CompileFileInfo):
+            maps.append((info.file_info, info.workspace_dir_info))
+        else:
+            return None
+
+    changed = set()
+    for a, b in zip(*maps):
+        if a is b:
+            continue
+        # files in a module share the command string, compare is cheap when unchanged
+        changed.update(f for f, v in b.items() if a.get(f) != v)
+        changed.update(f for f in a if f not in b)
+
+    # module command also changes with new files overlay
+    old_extra, new_extra = (info.extra_files if info else {} for info in (old, new))
+    for command in old_extra.keys() | new_extra.keys():
+        if old_extra.get(command) != new_extra.get(command):
+            for info in (old, new):
+                if info and command in info.extra_files:
+                    changed.update(info.groupby_cmd().get(command, ()))
+    return changed
+
+
 def GetFlagsInCompile(filename, compileFile, store):
     """read flags from compileFile. filename should be realpath"""
     if compileFile:
-        command = commandForFile(filename, compileFile, store)
-        if command:
-            flags = cmd_split(command)[1:]  # ignore executable
-            return list(filterFlags(flags, store.setdefault("filelist", {})))
+        overlay = compileFileInfoFromStore(compileFile, store).get_overlay(filename)
+        if overlay:
+            command, new_files = overlay
+            # files in same module share command, cache the final flags
+            cache: FlagsCache = store.get("flags") or store.setdefault("flags", FlagsCache())
+            flags = cache.get(command)
+            if flags is None:
+                flags = cmd_split(command)[1:]  # ignore executable
+                flags = tuple(filterFlags(flags, fileListCacheFromStore(store)))
+                cache.put(command, flags)
+            # new files are inserted after executable, newest first. see insertFilesIntoCommand
+            return [*reversed(new_files), *flags]
 
 
 def GetFlags(filename: str, compileFile=None, store=None):
@@ -400,6 +1071,45 @@ def GetWorkingDirectory(filename: str, compileFile=None, store=None):
     return None
 
 
+def inferFlagsForModuleRoot(project_root, flagFile, compileFile, store) -> tuple:
+    """
+    flags of files under a .swiftflags root, not depend on the file itself, so cache them per root.
+    invalidated when .swiftflags or .compile changes, or directory index changes(file added or removed).
+    all indexed directories are checked on each call, so a hit only cost stat them.
+    """
+    cache = store.setdefault("inferFlags", {})  # {flagFile: (flags, stats, index generation)}
+    stats = (fileStat(flagFile), compileFile and fileStat(compileFile))
+    index = directoryIndex(project_root, store, check=True)
+    if (entry := cache.get(flagFile)) and entry[1] == stats and entry[2] == index.generation:
+        return entry[0]
+
+    final_flags = []
+    headers, frameworks = index.header_dirs()
+    for h in headers:
+        final_flags += ["-Xcc", "-I" + h]
+    for f in frameworks:
+        final_flags.append("-F" + f)
+    swiftfiles = index.swift_files()
+    final_flags += swiftfiles
+    a = additionalFlags(flagFile)
+    if a:
+        # sourcekit not allow same swift name. so if same name, use the find one to support move file
+        swift_names = set(os.path.basename(p) for p in swiftfiles)
+        final_flags += (
+            arg
+            for arg in filterFlags(a, fileListCacheFromStore(store))
+            if os.path.basename(arg) not in swift_names
+        )
+    else:
+        final_flags += [
+            "-sdk",
+            os.path.join(getXcodeBasePath(), "Platforms/MacOSX.platform/Developer/SDKs/MacOSX.sdk/"),
+        ]
+    flags = tuple(final_flags)
+    cache[flagFile] = (flags, stats, index.generation)
+    return flags
+
+
 # TODO: c family infer flags #
 def InferFlagsForSwift(filename, compileFile, store):
     """try infer flags by convention and workspace files"""
@@ -416,8 +1126,8 @@ def InferFlagsForSwift(filename, compileFile, store):
         ]
 
         compile_file_info = compileFileInfoFromStore(compileFile, store)
-        for file, command in compile_file_info.file_info.items():
-            if file.startswith(f"{package_dir}/sources/") and file.endswith(".swift"):
+        for file, command in compile_file_info.files_under(f"{package_dir}/sources/"):
+            if file.endswith(".swift"):
                 flags = cmd_split(command)[1:]  # ignore executable
                 swift_version_index = flags.index("-swift-version")
                 if swift_version_index != -1 and swift_version_index + 1 < len(flags):
@@ -436,33 +1146,12 @@ def InferFlagsForSwift(filename, compileFile, store):
         ]
         return final_flags
 
-    project_root, flagFile, compileFile = findSwiftModuleRoot(filename)
+    project_root, flagFile, compileFile = findSwiftModuleRoot(filename, store)
     logging.debug(f"infer root: {project_root}, {compileFile}")
     final_flags = GetFlagsInCompile(filename, compileFile, store)
 
     if not final_flags and flagFile:
-        final_flags = []
-        headers, frameworks = findAllHeaderDirectory(project_root, store)
-        for h in headers:
-            final_flags += ["-Xcc", "-I" + h]
-        for f in frameworks:
-            final_flags.append("-F" + f)
-        swiftfiles = findAllSwiftFiles(project_root)
-        final_flags += swiftfiles
-        a = additionalFlags(flagFile)
-        if a:
-            # sourcekit not allow same swift name. so if same name, use the find one to support move file
-            swift_names = set(os.path.basename(p) for p in swiftfiles)
-            final_flags += (
-                arg
-                for arg in filterFlags(a, store.setdefault("filelist", {}))
-                if os.path.basename(arg) not in swift_names
-            )
-        else:
-            final_flags += [
-                "-sdk",
-                os.path.join(getXcodeBasePath(), "Platforms/MacOSX.platform/Developer/SDKs/MacOSX.sdk/"),
-            ]
+        final_flags = list(inferFlagsForModuleRoot(project_root, flagFile, compileFile, store))
     if not final_flags:
         final_flags = [
             filename,
@@ -21,5 +21,25 @@ class Env:
     def new_file(self):
         return self.on_key("XBS_FEAT_NEWFILE", default=True)
 
+    @property
+    @cache
+    def sqlite(self):
+        return self.on_key("XBS_FEAT_SQLITE", default=False)
+
+    @property
+    @cache
+    def concurrent(self):
+        return self.on_key("XBS_FEAT_CONCURRENT", default=False)
+
+    @property
+    @cache
+    def targets(self):
+        return self.on_key("XBS_FEAT_TARGETS", default=True)
+
+    @property
+    @cache
+    def stats(self):
+        return self.on_key("XBS_FEAT_STATS", default=False)
+
 env = Env()
 
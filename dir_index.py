@@ -0,0 +1,210 @@
+"""
+index of .h and .swift files under a directory, used to infer flags for files in a .swiftflags root.
+
+it replaces `find` subprocesses. each directory records its mtime and listing,
+so a refresh only stats directories, and relists those whose mtime changed (entry added, removed or renamed).
+requests check indexed directories by check, the server refresh it periodically and notify changes by take_changes.
+"""
+
+import logging
+import os
+from threading import Lock
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# bump when DirRecord changes
+INDEX_VERSION = 1
+# seconds between two periodical refresh by server
+REFRESH_INTERVAL = 5.0
+
+
+class DirRecord(NamedTuple):
+    mtime: int
+    linked: bool  # reached through a symlink dir under root
+    headers: Tuple[str, ...]  # names of *.h
+    swifts: Tuple[str, ...]  # names of *.swift
+    subdirs: Tuple[Tuple[str, bool], ...]  # (name, is symlink)
+
+
+def list_dir(directory, mtime, linked) -> DirRecord:
+    headers, swifts, subdirs = [], [], []
+    try:
+        with os.scandir(directory) as it:
+            for e in it:
+                try:
+                    if e.is_dir():  # follow symlink, like find -L
+                        subdirs.append((e.name, e.is_symlink()))
+                    elif e.name.endswith(".h"):
+                        headers.append(e.name)
+                    elif e.name.endswith(".swift"):
+                        swifts.append(e.name)
+                except OSError:
+                    pass
+    except OSError as e:
+        logging.debug(f"scan {directory} failed: {e}")
+    return DirRecord(mtime, linked, tuple(headers), tuple(swifts), tuple(subdirs))
+
+
+class DirectoryIndex(object):
+    def __init__(self, root, index_path=None):
+        self.root = root
+        self.index_path = index_path
+        self.lock = Lock()  # protect swap dirs and results
+        self.refresh_lock = Lock()  # one scan at a time
+        self.dirs: Dict[str, DirRecord] = {}  # replaced as a whole, never modified
+        self.generation = 0  # increase when any directory changes
+        self.taken_generation = 0  # generation when last take_changes
+        self.refreshed_at: Optional[float] = None
+        self._header_dirs: Optional[Tuple[Set[str], Set[str]]] = None
+        self._swift_files: Optional[List[str]] = None
+        if index_path:
+            self.load()
+
+    def refresh(self) -> bool:
+        """rescan the whole tree, relist changed directories. return True if anything changed"""
+        with self.refresh_lock:
+            first = self.refreshed_at is None
+            old = self.dirs
+            dirs = {}
+            changed = self._scan(self.root, False, set(), old, dirs) or dirs.keys() != old.keys()
+            self.refreshed_at = time.monotonic()
+            if changed:
+                self._publish(dirs)
+                if self.index_path:
+                    self.save()
+            if first:  # first refresh is the base of changes
+                self.taken_generation = self.generation
+            return changed
+
+    def take_changes(self) -> bool:
+        """return True if anything changed since last call"""
+        with self.lock:
+            changed = self.taken_generation != self.generation
+            self.taken_generation = self.generation
+            return changed
+
+    def check(self) -> bool:
+        """stat all indexed directories, relist the changed ones. return True if anything changed"""
+        changed = []
+        for directory, record in self.dirs.items():  # dirs is replaced, never modified
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != record.mtime:
+                changed.append(directory)
+        return bool(changed) and self.update(changed)
+
+    def update(self, dirs: Iterable[str]) -> bool:
+        """
+        cheap check for the given directories, or their nearest indexed ancestors.
+        relist the changed ones with their sub directories. return True if anything changed
+        """
+        with self.refresh_lock:
+            return self._update(dirs)
+
+    def _update(self, dirs):
+        old = self.dirs
+        changed = {}  # {dir: new records under it}
+        for directory in dirs:
+            while directory not in old and directory.startswith(self.root + "/"):
+                directory = os.path.dirname(directory)
+            if (record := old.get(directory)) is None or directory in changed:
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != record.mtime:
+                self._scan(directory, record.linked, set(), old, sub := {})
+                changed[directory] = sub
+        if not changed:
+            return False
+
+        prefixes = tuple(d + "/" for d in changed)
+        dirs = {d: r for d, r in old.items() if d not in changed and not d.startswith(prefixes)}
+        for sub in changed.values():
+            dirs.update(sub)
+        self._publish(dirs)
+        return True
+
+    def _publish(self, dirs):
+        with self.lock:
+            self.dirs = dirs
+            self.generation += 1
+            self._header_dirs = self._swift_files = None
+
+    def _scan(self, directory, linked, ancestors, old, dirs) -> bool:
+        try:
+            st = os.stat(directory)
+        except OSError:
+            return False  # removed, the missing key will be noticed
+        key = (st.st_dev, st.st_ino)
+        if key in ancestors:  # symlink loop
+            return False
+        record = old.get(directory)
+        changed = record is None or record.mtime != st.st_mtime_ns
+        if changed:
+            record = list_dir(directory, st.st_mtime_ns, linked)
+        dirs[directory] = record
+
+        ancestors.add(key)
+        for name, symlink in record.subdirs:
+            if self._scan(os.path.join(directory, name), linked or symlink, ancestors, old, dirs):
+                changed = True
+        ancestors.discard(key)
+        return changed
+
+    def header_dirs(self) -> Tuple[Set[str], Set[str]]:
+        """(header dirs, framework search dirs)"""
+        with self.lock:
+            if self._header_dirs is None:
+                headerDirs = set()
+                frameworks = set()
+                for directory, record in self.dirs.items():
+                    if not record.headers:
+                        continue
+                    frameworkIndex = directory.rfind(".framework")
+                    if frameworkIndex != -1:
+                        frameworks.add(os.path.dirname(directory[:frameworkIndex]))
+                    else:
+                        # contains more one dir for import with module name
+                        # don't contains more one module name dir. if need, can specify in .flags
+                        # conflict with #if_include framework check
+                        headerDirs.add(directory)
+                self._header_dirs = (headerDirs, frameworks)
+            return self._header_dirs
+
+    def swift_files(self) -> List[str]:
+        """realpath of swift files, not include files in symlink dirs, like find -H"""
+        with self.lock:
+            if self._swift_files is None:
+                self._swift_files = [
+                    os.path.realpath(os.path.join(directory, name))
+                    for directory, record in sorted(self.dirs.items())
+                    if not record.linked
+                    for name in sorted(record.swifts)
+                ]
+            return self._swift_files
+
+    def load(self):
+        import pickle
+
+        try:
+            with open(self.index_path, "rb") as f:
+                version, root, dirs = pickle.load(f)
+            if version == INDEX_VERSION and root == self.root:
+                self.dirs = {d: DirRecord(*r) for d, r in dirs.items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"invalid directory index {self.index_path}: {e}")
+
+    def save(self):
+        from misc import dump_pickle
+
+        dirs = {d: tuple(r) for d, r in self.dirs.items()}
+        try:
+            dump_pickle(self.index_path, (INDEX_VERSION, self.root, dirs))
+        except OSError as e:
+            logging.warning(f"save directory index failed: {e}")
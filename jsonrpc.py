@@ -0,0 +1,143 @@
+"""
+json rpc transport over stdio, framed by Content-Length header in bytes.
+
+read and write use binary stdin.buffer/stdout.buffer, so non ascii content won't break the framing.
+messages sent in one loop iteration (eg: response and notifications burst) are joined into one write.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import stat
+import sys
+from threading import Thread, get_ident
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+HEADER_END = b"\r\n\r\n"
+
+
+def encode_message(data_str: str) -> bytes:
+    body = data_str.encode("utf-8")
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """return message body, or None when input closed"""
+    try:
+        header = await reader.readuntil(HEADER_END)
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            logger.warning(f"incomplete header at eof: {e.partial!r}")
+        return None
+
+    length = None
+    for line in header.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    if length is None:
+        raise ValueError(f"missing Content-Length in header: {header!r}")
+
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def open_reader(input) -> asyncio.StreamReader:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    fd = input.fileno()
+    # pipe can be read by loop directly. other file may share description with stdout(eg: tty),
+    # set it nonblocking will break blocking write, so read them in a thread
+    if stat.S_ISFIFO(os.fstat(fd).st_mode):
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), input)
+        return reader
+
+    def read_forever():
+        try:
+            while data := os.read(fd, 1 << 16):
+                loop.call_soon_threadsafe(reader.feed_data, data)
+        except OSError as e:
+            logger.debug(f"read input error: {e}")
+        finally:
+            loop.call_soon_threadsafe(reader.feed_eof)
+
+    Thread(target=read_forever, daemon=True, name="input").start()
+    return reader
+
+
+class Transport(object):
+    """write queue of framed message. send is thread-safe"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, output):
+        self.loop = loop
+        self.output = output
+        self.thread_id = get_ident()
+        self.pending = []
+        self.scheduled = False
+
+    def send(self, frame: bytes):
+        if get_ident() == self.thread_id:
+            self._enqueue(frame)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._enqueue, frame)
+        except RuntimeError as e:
+            # loop closed, output won't be written anymore, time to quit
+            raise SystemExit(0) from e
+
+    def _enqueue(self, frame: bytes):
+        self.pending.append(frame)
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.pending:
+            return
+        data = b"".join(self.pending)
+        self.pending.clear()
+        try:
+            self.output.write(data)
+            self.output.flush()
+        except IOError as e:
+            # stdout closed, time to quit
+            raise SystemExit(0) from e
+
+
+transport: Optional[Transport] = None
+
+
+def write(data_str: str):
+    """write a message to output. thread-safe"""
+    frame = encode_message(data_str)
+    if transport:
+        transport.send(frame)
+    else:  # not serving, write directly
+        sys.stdout.buffer.write(frame)
+        sys.stdout.buffer.flush()
+
+
+async def _serve(handle: Callable[[dict], None], input, output):
+    global transport
+    transport = Transport(asyncio.get_running_loop(), output)
+    reader = await open_reader(input)
+    try:
+        while (raw := await read_message(reader)) is not None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Req --> %s", raw.decode("utf-8", "replace"))
+            handle(json.loads(raw))
+            # let queued messages flush before next request
+            await asyncio.sleep(0)
+    finally:
+        transport.flush()
+
+
+def serve(handle: Callable[[dict], None], input=None, output=None):
+    """read message from input until closed, and call handle with the decoded message in the loop thread"""
+    asyncio.run(_serve(handle, input or sys.stdin.buffer, output or sys.stdout.buffer))
@@ -0,0 +1,108 @@
+"""
+latency and payload statistics of server methods, enabled by XBS_FEAT_STATS=1.
+
+caller should check `enabled` before measure, so there is no cost when disabled.
+"""
+
+import json
+import math
+import os
+from threading import Lock
+import time
+
+from config import env
+
+enabled = env.stats
+
+# latency histogram use log buckets, each bucket is 10% wider than previous.
+# so percentile has at most 10% error, and memory is bounded
+BUCKET_BASE = 1.1
+MIN_SECONDS = 1e-5
+
+
+class Histogram(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = {}  # {bucket index: count}
+
+    def add(self, seconds, size):
+        self.count += 1
+        self.bytes += size
+        if seconds is None:
+            return
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        index = math.ceil(math.log(max(seconds, MIN_SECONDS) / MIN_SECONDS, BUCKET_BASE))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, p):
+        """upper bound of the bucket which contains p percentile"""
+        timed = sum(self.buckets.values())
+        if not timed:
+            return None
+        rank = p / 100 * timed
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(MIN_SECONDS * BUCKET_BASE**index, self.max)
+        return self.max
+
+    def summary(self):
+        timed = sum(self.buckets.values())
+
+        def ms(v):
+            return None if v is None else round(v * 1000, 3)
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / timed) if timed else None,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max) if timed else None,
+            "bytes": self.bytes,
+        }
+
+
+lock = Lock()
+histograms = {}  # {name: Histogram}
+start_time = time.time()
+
+
+def record(name, seconds=None, size=0):
+    """record a call of name. seconds None means only count the payload size"""
+    with lock:
+        if (h := histograms.get(name)) is None:
+            h = histograms[name] = Histogram()
+        h.add(seconds, size)
+
+
+def summary():
+    with lock:
+        return {
+            "enabled": enabled,
+            "uptime": round(time.time() - start_time, 3),
+            "methods": {name: h.summary() for name, h in sorted(histograms.items())},
+        }
+
+
+def dump(path):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(summary(), f, indent="\t")
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def dump_dir(cache_path):
+    """dir to dump stats, beside log file if log to a file"""
+    logpath = os.environ.get("XBS_LOGPATH")
+    if logpath and not logpath.startswith(":"):
+        return os.path.dirname(os.path.abspath(logpath))
+    return cache_path
@@ -7,12 +7,10 @@ def bundle_path(path):
 
 def get_mtime(path):
     """return mtime, or 0 when not exists"""
-    if os.path.exists(path):
-        try:
-            return os.stat(path).st_mtime
-        except FileNotFoundError:
-            pass
-    return 0
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
 
 
 def force_remove(path):
@@ -21,6 +19,31 @@ def force_remove(path):
     except FileNotFoundError:
         pass
 
+def cache_file_path(cache_path, prefix, key: str):
+    """path of a file in cache dir, named by md5 of key"""
+    import hashlib
+
+    name = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_path, f"{prefix}-{name}")
+
+
+def dump_pickle(path, *objs):
+    """pickle objs into path in order, replace it when all done. raise OSError if failed"""
+    import pickle
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for obj in objs:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def version_compare(a: str, b: str):
     """
     compare version string
@@ -2,35 +2,62 @@ import hashlib
 import json
 import logging
 import os
+import signal
 import sys
-from threading import Lock, Thread, main_thread
+from threading import RLock, Thread, main_thread
 import time
-from typing import Optional
+from typing import List, NamedTuple, Optional
 import urllib.parse
 from pathlib import Path
 
 from compile_database import (
+    FlagsCache,
     GetFlags,
     GetWorkingDirectory,
     InferFlagsForSwift,
+    commandForFile,
+    compileFileInfoFromStore,
+    diffCompileFileInfo,
+    fallbackFilesForCompileFile,
     filekey,
+    getXcodeBasePath,
+    loadedCompileFileInfo,
+    refreshDirectoryIndexes,
+    storeLock,
+    targetDependenciesForCompileFile,
+    targetNamesForFiles,
+    targetsForCompileFile,
     newfileForCompileFile,
 )
 from config import ServerConfig, env
+from dir_index import REFRESH_INTERVAL
+import jsonrpc
+import metrics
 from misc import force_remove, get_mtime, VERSION, version_compare
 
 logger = logging.getLogger(__name__)
 
 
 def send(data):
-    data_str = json.dumps(data)
+    """send a message, can be called from any thread. data can be a serialized json str"""
+    data_str = data if isinstance(data, str) else json.dumps(data)
     logger.debug("Res <-- %s", data_str)
-    try:
-        sys.stdout.write(f"Content-Length: {len(data_str)}\r\n\r\n{data_str}")
-        sys.stdout.flush()
-    except IOError as e:
-        # stdout closed, time to quit
-        raise SystemExit(0) from e
+    jsonrpc.write(data_str)
+    return len(data_str)
+
+
+def low_priority_command():
+    """command prefix to run with background cpu and io priority"""
+    import shutil
+
+    if shutil.which("taskpolicy"):  # macOS
+        return ["taskpolicy", "-b"]
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "10"]
+    return prefix
 
 
 def uri2filepath(uri):
@@ -51,6 +78,59 @@ def uptodate(target: str, srcs: list[str]):
     return all(src_mtime < target_mtime for src_mtime in srcs_mtime)
 
 
+# fallback target which contains files not in module targets, and root directory for files not in compile file
+DUMMY_TARGET = "dummy://dummy"
+
+language_ids = {
+    ".swift": "swift",
+    ".c": "c",
+    ".m": "objective-c",
+    ".mm": "objective-cpp",
+    ".cpp": "cpp",
+    ".cc": "cpp",
+    ".cxx": "cpp",
+}
+
+
+def target_uri(name):
+    return "module://" + urllib.parse.quote(name)
+
+
+def target_name(uri) -> Optional[str]:
+    if uri.startswith("module://"):
+        return urllib.parse.unquote(uri[len("module://") :])
+    return None
+
+
+class ArgumentsCache(FlagsCache):
+    """LRU cache of {command: serialized compiler arguments}"""
+
+    @staticmethod
+    def sizeof(arguments):
+        return len(arguments)
+
+
+class SerializedOptions(NamedTuple):
+    """options of a file, with arguments serialized. big module may have MB of arguments"""
+
+    arguments: str  # json array
+    workingDirectory: str
+
+    def json(self, arguments_key):
+        return '{"%s": %s, "workingDirectory": %s}' % (
+            arguments_key,
+            self.arguments,
+            json.dumps(self.workingDirectory),
+        )
+
+
+class CompileSnapshot(NamedTuple):
+    """immutable compile state, replace as a whole when compile info changes"""
+
+    compile_file: Optional[str]  # None if not exists
+    store: dict  # cache of compile info, see compile_database
+
+
 class State(object):
     def __init__(self, root_path: str, cache_path, new_version):
         """
@@ -68,8 +148,16 @@ class State(object):
 
         # opened files need to be notified when flags changed
         self.observed_uri = set()
+        # files added by new_file, add them again after compile info reload. dict as ordered set
+        self.additional_files = {}
+        # recent opened files, newest first. persist for warm up, saved by observe thread when dirty
+        self.recent_uris = self.load_recent_uris()
+        self.recent_uris_dirty = False
+        self.recent_uris_save_time = 0.0
         # background thread to observe changes
         self.observed_thread: Optional[Thread] = None
+        self.watcher = None
+        self.parse_process = None  # background parse process
 
         self.exception_count = 0
         self.last_exception_time = 0.0
@@ -77,10 +165,14 @@ class State(object):
         # {path: mtime} cache. use to find changes
         self.observed_info = {self.config.path: get_mtime(self.config.path)}
 
+        self.snapshot: CompileSnapshot = None  # type: ignore
         self.reinit_compile_info()
         # NOTE:thread-safety: for state shared by main and background watch thread,
         # can only changed in sync_compile_file, which block all thread and no one access it.
         # other time, the shared state is readonly and safe..
+        # when env.concurrent, requests run in worker threads and read self.snapshot once,
+        # sync_compile_file prepare a new snapshot and publish it by a atomic assign.
+        # workers change shared state(eg: additional_files by new_file) with mainlock, lock order is mainlock then store lock.
 
     def get_compile_file(self, config: ServerConfig):
         # isolate xcode generate compile file and manual compile_file
@@ -93,20 +185,59 @@ class State(object):
         # manual compile_file
         return os.path.join(self.root_path, ".compile")
 
+    @property
+    def store(self):
+        return self.snapshot.store
+
+    @property
+    def compile_file(self):
+        return self.snapshot.compile_file
+
     def reinit_compile_info(self):
         """all the compile information may change in background"""
+        self.publish_snapshot(*self.make_snapshot(list(self.additional_files)))
 
+    def make_snapshot(self, additional_files, preload=False):
+        """
+        build a new snapshot without change shared state, so it can run without mainlock.
+        return (snapshot, compile file path, its mtime) for publish_snapshot
+        :param additional_files: files added by new_file
+        :param preload: load compile info before return, so requests using old snapshot won't wait for it
+        """
         # store use to save compile_datainfo. it will be reload when config changes.
-        self.store = {}  # main-thread
-        self._compile_file = self.get_compile_file(self.config)
-        if os.path.exists(self._compile_file):
-            self.compile_file = self._compile_file
-            logger.info(f"use flags from {self._compile_file}")
+        # cache_path is used to persist index of compile file
+        store = {
+            "cache_path": self.cache_path,
+            "additional_files": [f for f in additional_files if os.path.exists(f)],
+        }
+        compile_path = self.get_compile_file(self.config)
+        # compile_path may change. need to init mtime to avoid trigger a change event
+        mtime = get_mtime(compile_path)
+        if os.path.exists(compile_path):
+            compile_file = compile_path
+            logger.info(f"use flags from {compile_path}")
         else:
-            self.compile_file = None
+            compile_file = None
 
-        # self._compile_file may change. need to init mtime to avoid trigger a change event
-        self.observed_info[self._compile_file] = get_mtime(self._compile_file)
+        if preload and compile_file:
+            try:
+                compileFileInfoFromStore(compile_file, store)
+            except Exception as e:
+                # leave it to request, which report the error as before
+                logger.error(f"preload compile info failed: {e}")
+        return CompileSnapshot(compile_file, store), compile_path, mtime
+
+    def publish_snapshot(self, snapshot: CompileSnapshot, compile_path, mtime):
+        """should hold mainlock, except when init"""
+        if self.snapshot and (flags_cache := self.store.get("flags")):
+            logger.debug(f"flags cache stats: {flags_cache.stats()}")
+        if self.snapshot and (arguments_cache := self.store.get("arguments")):
+            logger.debug(f"arguments cache stats: {arguments_cache.stats()}")
+        if self.snapshot and (filelist_cache := self.store.get("filelist")):
+            logger.debug(f"filelist cache stats: {filelist_cache.stats()}")
+        self._compile_file = compile_path
+        self.observed_info[compile_path] = mtime
+        self.snapshot = snapshot
 
     @property
     def indexStorePath(self) -> Optional[str]:
@@ -123,61 +254,144 @@ class State(object):
 
         return output_lock_path(self._compile_file)
 
+    recent_limit = 32
+
+    recent_save_interval = 10
+
+    @property
+    def recent_uris_path(self):
+        return os.path.join(self.cache_path, "recent_uris")
+
+    def load_recent_uris(self) -> list:
+        import pickle
+
+        try:
+            with open(self.recent_uris_path, "rb") as f:
+                uris = pickle.load(f)
+            if isinstance(uris, list):
+                return [v for v in uris if isinstance(v, str)][: self.recent_limit]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug(f"load recent uris failed: {e}")
+        return []
+
+    def add_recent_uri(self, uri):
+        if self.recent_uris[:1] == [uri]:
+            return
+        uris = [uri] + [v for v in self.recent_uris if v != uri]
+        self.recent_uris = uris[: self.recent_limit]  # replace as a whole, read by observe thread
+        self.recent_uris_dirty = True
+
+    def save_recent_uris(self):
+        from misc import dump_pickle
+
+        if not self.recent_uris_dirty:
+            return
+        self.recent_uris_dirty = False  # before read, so change during save is saved next time
+        self.recent_uris_save_time = time.time()
+        try:
+            dump_pickle(self.recent_uris_path, self.recent_uris)
+        except OSError as e:
+            logger.debug(f"save recent uris failed: {e}")
+
+    def start_warmup(self):
+        Thread(target=self.warmup, daemon=True, name="warmup").start()
+
+    def warmup(self):
+        """
+        load compile info and resolve flags of recent files in background.
+        requests before it finish wait the loading by store lock, instead of load again.
+        """
+        start_time = time.time()
+        snapshot = self.snapshot
+        try:
+            getXcodeBasePath()
+            if snapshot.compile_file:
+                compileFileInfoFromStore(snapshot.compile_file, snapshot.store)
+            for uri in self.recent_uris:
+                if os.path.exists(uri2filepath(uri)):
+                    self.optionsForFile(uri, snapshot)
+        except Exception as e:
+            logger.error(f"warm up failed: {e}")
+        logger.debug(f"warm up finished in {time.time() - start_time:.3f}s")
+        if metrics.enabled:
+            metrics.record("warmup", time.time() - start_time)
+
     def register_uri(self, uri):
         self.observed_uri.add(uri)
+        self.add_recent_uri(uri)
 
         file_path = uri2realpath(uri)
-        flags = GetFlags(file_path, self.compile_file, store=self.store)
+        compile_file, store = self.snapshot
+        flags = GetFlags(file_path, compile_file, store=store)
 
         if not flags and env.new_file:
-            if filekeys := newfileForCompileFile(
-                file_path, self.compile_file, store=self.store
-            ):
+            if filekeys := self.new_file(file_path, compile_file, store):
                 # add new file success, update options for module files
-                for v in self.observed_uri:
+                for v in list(self.observed_uri):
                     if filekey(uri2filepath(v)) in filekeys:
                         self.notify_option_changed(v)
                 return
 
+        command = flags and commandForFile(file_path, compile_file, store)
         if not flags and file_path.endswith(".swift"):
-            flags = InferFlagsForSwift(file_path, self.compile_file, store=self.store)
+            flags = InferFlagsForSwift(file_path, compile_file, store=store)
+
+        working_directory = GetWorkingDirectory(file_path, compile_file, store=store)
 
-        working_directory = GetWorkingDirectory(file_path, self.compile_file, store=self.store)
+        self._notify_option_changed(
+            uri, self.optionsForFlags(flags, working_directory, command, store)
+        )
 
-        self._notify_option_changed(uri, self.optionsForFlags(flags, working_directory))
+    def new_file(self, file_path, compile_file, store):
+        """add file to the module of a similar file, remember it for reload"""
+        if filekeys := newfileForCompileFile(file_path, compile_file, store=store):
+            with mainlock:  # may run in worker thread
+                self.additional_files[file_path] = None
+        return filekeys
 
     def unregister_uri(self, uri):
         self.observed_uri.remove(uri)
 
-    def sourceKitOptions(self, uri):
+    def sourceKitOptions(self, uri) -> Optional[str]:
+        """return serialized result"""
         file_path = uri2realpath(uri)
-        flags = GetFlags(file_path, self.compile_file, store=self.store)
+        compile_file, store = self.snapshot
+        flags = GetFlags(file_path, compile_file, store=store)
         if not flags and env.new_file:
-            if newfileForCompileFile(file_path, self.compile_file, store=self.store):
-                flags = GetFlags(file_path, self.compile_file, store=self.store)
-                self.notify_target_changes()
+            if self.new_file(file_path, compile_file, store):
+                flags = GetFlags(file_path, compile_file, store=store)
+                with mainlock:  # may run in worker thread
+                    self.notify_target_changes()
 
+        command = flags and commandForFile(file_path, compile_file, store)
         if not flags and file_path.endswith(".swift"):
-            flags = InferFlagsForSwift(file_path, self.compile_file, store=self.store)
+            flags = InferFlagsForSwift(file_path, compile_file, store=store)
 
-        working_directory = GetWorkingDirectory(file_path, self.compile_file, store=self.store)
+        working_directory = GetWorkingDirectory(file_path, compile_file, store=store)
 
-        if result := self.optionsForFlags(flags, working_directory):
-            return {
-                "compilerArguments": result["options"],
-                "workingDirectory": result["workingDirectory"],
-            }
+        if result := self.optionsForFlags(flags, working_directory, command, store):
+            return result.json("compilerArguments")
         return None
 
-    def optionsForFile(self, uri):
+    def optionsForFile(self, uri, snapshot: Optional[CompileSnapshot] = None):
         file_path = uri2realpath(uri)
-        flags = GetFlags(file_path, self.compile_file, store=self.store)
+        compile_file, store = snapshot or self.snapshot
+        flags = GetFlags(file_path, compile_file, store=store)
+        command = flags and commandForFile(file_path, compile_file, store)
         if not flags and file_path.endswith(".swift"):
-            flags = InferFlagsForSwift(file_path, self.compile_file, store=self.store)
-        working_directory = GetWorkingDirectory(file_path, self.compile_file, store=self.store)
-        return self.optionsForFlags(flags, working_directory)
+            flags = InferFlagsForSwift(file_path, compile_file, store=store)
+        working_directory = GetWorkingDirectory(file_path, compile_file, store=store)
+        return self.optionsForFlags(flags, working_directory, command, store)
 
-    def optionsForFlags(self, flags, working_directory):
+    def optionsForFlags(
+        self, flags, working_directory, command=None, store=None
+    ) -> Optional[SerializedOptions]:
+        """
+        :param command: the command flags come from. files in same module share it,
+            so the serialized arguments are cached by it in store
+        """
         if flags is None:
             return None
         try:
@@ -187,31 +401,46 @@ class State(object):
                 workdir = working_directory
             else:
                 workdir = os.getcwd()
-        return {
-            "options": flags,
-            "workingDirectory": workdir,
-        }
+        return SerializedOptions(self.serializeArguments(flags, command, store), workdir)
+
+    def serializeArguments(self, flags, command, store):
+        if not command:
+            return json.dumps(flags)
+        cache: ArgumentsCache = store.get("arguments") or store.setdefault(
+            "arguments", ArgumentsCache()
+        )
+        arguments = cache.get(command)
+        if arguments is None:
+            arguments = json.dumps(flags)
+            cache.put(command, arguments)
+        return arguments
 
     def notify_option_changed(self, uri):
         # no clear options?
         self._notify_option_changed(uri, self.optionsForFile(uri))
 
-    def _notify_option_changed(self, uri, options):
+    def _notify_option_changed(self, uri, options: Optional[SerializedOptions]):
         # empty options is nouse and lsp will stop working.., at least there should has a infer flags..
         if options is None:
             return
-        notification = {
-            "jsonrpc": "2.0",
-            "method": "build/sourceKitOptionsChanged",
-            "params": {
-                "uri": uri,
-                "updatedOptions": options,
-            },
-        }
-        send(notification)
+        # splice serialized options, same as:
+        # {"jsonrpc": "2.0", "method": "build/sourceKitOptionsChanged", "params": {"uri": uri, "updatedOptions": options}}
+        notification = (
+            '{"jsonrpc": "2.0", "method": "build/sourceKitOptionsChanged", "params": {"uri": %s, "updatedOptions": %s}}'
+            % (json.dumps(uri), options.json("options"))
+        )
+        size = send(notification)
+        if metrics.enabled:
+            metrics.record("build/sourceKitOptionsChanged", size=size)
 
     def shutdown(self):
         self.observed_thread = None  # release to end in subthread
+        self.cancel_parse()
+        self.save_recent_uris()
+        if metrics.enabled:
+            self.dump_stats()
+        if self.watcher:
+            self.watcher.wakeup()
 
     ########## observed flag changes in background
 
@@ -220,6 +449,11 @@ class State(object):
             logger.warn("already observing!!")
             return
 
+        from watcher import create_watcher
+
+        watcher = self.watcher = create_watcher()
+        logger.debug(f"observe changes by {type(watcher).__name__}")
+
         def start():
             try:
                 while (
@@ -227,6 +461,7 @@ class State(object):
                     and main_thread().is_alive()
                     and self == shared_state
                 ):
+                    timeout = min(self.observe_timeout, self.directory_refresh_interval)
                     try:
                         self.tick()
                     except Exception as e:
@@ -240,8 +475,17 @@ class State(object):
                         if self.exception_count >= 3:
                             raise
                         logger.error(f"observe tick failed ({self.exception_count}/3): {e}")
+                        timeout = 1  # retry soon
+
+                    if metrics.enabled and time.time() - self.stats_dump_time >= self.stats_dump_interval:
+                        self.dump_stats()
+                    if time.time() - self.recent_uris_save_time >= self.recent_save_interval:
+                        self.save_recent_uris()
 
-                    time.sleep(1)
+                    # tick again when observed paths change
+                    watcher.watch(self.observed_paths())
+                    if changed := watcher.wait(timeout):
+                        logger.debug(f"observed changes: {changed}")
             except Exception as e:
                 logger.exception(f"observe thread exit by exception: {e}")
 
@@ -250,7 +494,33 @@ class State(object):
         self.observed_thread = Thread(target=start)
         self.observed_thread.start()
 
+    # tick even no change event, for timeout checking and missing events
+    observe_timeout = 30
+
+    # refresh directory indexes of inferred flags, see handle_directory_change
+    directory_refresh_interval = REFRESH_INTERVAL
+    directory_refresh_time = 0.0
+
+    stats_dump_interval = 60
+    stats_dump_time = 0.0
+
+    def dump_stats(self):
+        self.stats_dump_time = time.time()
+        metrics.dump(os.path.join(metrics.dump_dir(self.cache_path), "xbs_stats.json"))
+
+    def observed_paths(self):
+        """paths tick check changes"""
+        paths = [self.config.path, self._compile_file]
+        if self.config.kind == "xcode" and (build_root := self.config.build_root):
+            from xcactivitylog import metapath_from_buildroot
+
+            paths.append(metapath_from_buildroot(build_root))
+            if self.locking_compile_file:
+                paths.append(self.compile_lock_path)
+        return paths
+
     def tick(self):
+        self.handle_directory_change()
         if self.handle_build_server_config_change():
             return
         if self.handle_compile_file_change():
@@ -262,6 +532,38 @@ class State(object):
         if log_path := self.log_path_for_invalid_compile_file():
             self.trigger_parse(log_path)
 
+    def handle_directory_change(self):
+        """
+        inferred flags of a .swiftflags root depend on files under it. refresh its directory index periodically,
+        so observed files get new flags when files are added or removed, even no request comes
+        """
+        if time.time() - self.directory_refresh_time < self.directory_refresh_interval:
+            return
+        self.directory_refresh_time = time.time()
+        snapshot = self.snapshot
+        if not (roots := refreshDirectoryIndexes(snapshot.store)):
+            return
+        with mainlock:
+            if self.snapshot is not snapshot:
+                return  # reloaded, all changes are notified
+            prefixes = tuple(os.path.join(root, "") for root in roots)
+            uris = [uri for uri in self.observed_uri if uri2realpath(uri).startswith(prefixes)]
+            logger.debug(f"directories changed: {roots}, notify {len(uris)} observed uris")
+            if not uris:
+                return
+            if self.new_version:
+                # files with inferred flags are not in compile file, they are in fallback target
+                send({
+                    "jsonrpc": "2.0",
+                    "method": "buildTarget/didChange",
+                    "params": {
+                        "changes": [{"target": {"uri": DUMMY_TARGET}, "kind": 2}]  # 2: changed
+                    },
+                })
+            else:
+                for uri in uris:
+                    self.notify_option_changed(uri)
+
     def handle_build_server_config_change(self):
         mtime = get_mtime(self.config.path)
         if mtime > self.observed_info.get(self.config.path, 0):
@@ -332,49 +634,227 @@ class State(object):
         return xcpath
 
     def trigger_parse(self, xcpath):
+        """
+        parse log in a low priority process, so it won't compete with requests.
+        requests use current snapshot until the compile file is written and changed.
+        a running parse of older log is cancelled.
+        """
         # FIXME: ensure index_store_path from buildServer.json consistent with parsed .compile file..
-        import xclog_parser
-
-        xclog_parser.hooks_echo_to_log = True
+        if parsing := self.parse_process:
+            if parsing.poll() is None:
+                if parsing.args[-1] == xcpath:  # type: ignore
+                    return
+                logger.info("newer log found, cancel parsing")
+                self.cancel_parse()
+
+        import subprocess
+        from misc import bundle_path
+
+        cmd = [sys.executable, bundle_path("xcode-build-server"), "parse"]
+        cmd += ["-a", "-o", self._compile_file]
+        if self.config.skip_validate_bin:
+            cmd.append("--skip-validate-bin")
+        if env.sqlite:
+            cmd.append("--sqlite")
+        cmd += ["-l", xcpath]
+        logger.info(f"parse log at {xcpath}")
+        # own process group, so cancel also stop its workers
+        process = subprocess.Popen(
+            low_priority_command() + cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            errors="replace",
+            start_new_session=True,
+        )
+        self.parse_process = process
+        Thread(target=self.wait_parse, args=(process, time.time()), daemon=True).start()
 
-        from xclog_parser import parse, OutputLockedError
+    def wait_parse(self, process, start_time):
+        """forward parse progress to log, and tick when finish"""
+        import xclog_parser
 
-        try:
-            cmd = ["xclog_parser", "-al", xcpath, "-o", self._compile_file]
-            if self.config.skip_validate_bin:
-                cmd.append("--skip-validate-bin")
-            logger.info(f"parse log at {xcpath}")
-            parse(cmd)
-            self.handle_compile_file_change()
-        except OutputLockedError:
+        progress = logging.getLogger("parser")
+        last = ""
+        for line in process.stderr:
+            last = line.rstrip("\n")
+            progress.debug(last)
+        code = process.wait()
+        if code == xclog_parser.LOCKED_EXIT_CODE:
             self.locking_compile_file = True
+        elif code < 0 or code == 128 + signal.SIGTERM:
+            logger.info("parse cancelled")
+        elif code != 0:
+            logger.error(f"parse log failed with code {code}: {last}")
+        elif metrics.enabled:
+            metrics.record("parse", time.time() - start_time)
+        if self.watcher:
+            self.watcher.wakeup()
+
+    def cancel_parse(self):
+        if (process := self.parse_process) and process.poll() is None:
+            import subprocess
+
+            # wait it release output lock, so next parse won't be locked
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                try:
+                    os.killpg(process.pid, sig)
+                    process.wait(5)
+                    break
+                except OSError:
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
 
     def sync_compile_file(self, before=None):
         """update to newest compile info to main thread
 
         NOTE: called by observe thread, and block main thread,
         to ensure when exit, all thread is in the runloop and no middle state.
+        when env.concurrent, only block main thread when publish the prepared snapshot.
         """
+        start_time = time.time()
+        self._sync_compile_file(before)
+        if metrics.enabled:
+            metrics.record("reload", time.time() - start_time)
+
+    def _sync_compile_file(self, before):
+        if not env.concurrent:
+            with mainlock:
+                if before:
+                    before()
+                old = self.snapshot
+                self.reinit_compile_info()
+
+                self.notify_target_changes(old)
+            return
+
         with mainlock:
             if before:
                 before()
-            self.reinit_compile_info()
+            additional_files = list(self.additional_files)
+        # requests keep using old snapshot until the new one is ready
+        prepared = self.make_snapshot(additional_files, preload=True)
+        with mainlock:
+            old = self.snapshot
+            self.publish_snapshot(*prepared)
+        self.notify_target_changes(old)
+
+    def targets(self, snapshot: Optional[CompileSnapshot] = None, load=True):
+        """{module target name: source files}. empty when targets is disabled"""
+        if not env.targets:
+            return {}
+        compile_file, store = snapshot or self.snapshot
+        return targetsForCompileFile(compile_file, store, load)
+
+    def fallback_files(self) -> List[str]:
+        """files in compile file but not in any module target"""
+        if not self.targets():
+            return []  # no module target, all files are in fallback target by root directory
+        compile_file, store = self.snapshot
+        return fallbackFilesForCompileFile(compile_file, store)
+
+    def target_dependencies(self):
+        """{module target name: dependency target names}"""
+        if not env.targets:
+            return {}
+        compile_file, store = self.snapshot
+        return targetDependenciesForCompileFile(compile_file, store)
+
+    def changed_targets(self, old: CompileSnapshot, changed_files, changed_uris):
+        """return target change events, None if target list changes"""
+        if not env.targets:
+            return [{"target": {"uri": DUMMY_TARGET}, "kind": 2}]  # 2: changed
+
+        old_targets = self.targets(old, load=False)
+        if old_targets is None:
+            return None  # never request targets, can't know which changes
+        if set(old_targets) != set(self.targets()):
+            return None
 
-            self.notify_target_changes()
+        infos = [
+            loadedCompileFileInfo(old.compile_file, old.store),
+            self.compile_file and compileFileInfoFromStore(self.compile_file, self.store),
+        ]
+        keys = set(changed_files)
+        keys.update(filekey(uri2filepath(uri)) for uri in changed_uris)
+        names = targetNamesForFiles(keys, infos[1], infos[0]).values()
+        changes = [
+            {"target": {"uri": target_uri(name)}, "kind": 2}
+            for name in sorted(set(filter(None, names)))
+        ]
+        if None in names:  # files only in fallback target
+            changes.append({"target": {"uri": DUMMY_TARGET}, "kind": 2})
+        return changes
+
+    def diff_snapshot(self, old: CompileSnapshot) -> Optional[set[str]]:
+        """return changed file keys from old snapshot to current, None if can't diff"""
+        old_info = None
+        if old.compile_file:
+            old_info = loadedCompileFileInfo(old.compile_file, old.store)
+            if old_info is None:
+                return None  # never loaded, nothing to compare
+        new_info = None
+        if self.compile_file:
+            try:
+                new_info = compileFileInfoFromStore(self.compile_file, self.store)
+            except Exception as e:
+                logger.error(f"load compile info failed: {e}")
+                return None
+        # new_file may change the infos in worker threads
+        with storeLock(old.store), storeLock(self.store):
+            return diffCompileFileInfo(old_info, new_info)
+
+    def diff_observed_options(self, old: CompileSnapshot) -> dict:
+        """return {uri: new options} for observed uri whose options changed"""
+        changed = {}
+        for uri in list(self.observed_uri):
+            try:
+                new_options = self.optionsForFile(uri)
+                if new_options != self.optionsForFile(uri, old):
+                    changed[uri] = new_options
+            except Exception as e:
+                logger.error(f"diff options of {uri} failed: {e}")
+                changed[uri] = None  # resend by notify_option_changed
+        return changed
+
+    def notify_target_changes(self, old: Optional[CompileSnapshot] = None):
+        """
+        :param old: snapshot before change. only notify changed targets and uris from it.
+            notify all when it's None or can't diff
+        """
+        changed_files = None if old is None else self.diff_snapshot(old)
+        if changed_files is None:
+            changed_uris = None
+        else:
+            # options may also change by filelist content, so compare observed options directly
+            changed_uris = self.diff_observed_options(old)  # type: ignore
+            logger.debug(
+                f"compile info changes: {len(changed_files)} files, {len(changed_uris)} observed uris"
+            )
+            if not changed_files and not changed_uris:
+                return
 
-    def notify_target_changes(self):
-        # TODO: increment diff change and notify #
         if self.new_version:
+            changes = None
+            if changed_uris is not None:
+                changes = self.changed_targets(old, changed_files, changed_uris)  # type: ignore
             send({
                 "jsonrpc": "2.0",
                 "method": "buildTarget/didChange",
                 "params": {
-                    "changes": None
+                    "changes": changes
                 },
             })
-        else:
-            for v in self.observed_uri:
+        elif changed_uris is None:
+            for v in list(self.observed_uri):
                 self.notify_option_changed(v)
+        else:
+            for v, options in changed_uris.items():
+                if options is None:
+                    self.notify_option_changed(v)
+                else:
+                    self._notify_option_changed(v, options)
 
 
 # valid after build_initialize. access before should throw
@@ -401,6 +881,7 @@ def server_api():
             logger.warn("already initialized!!")
         else:
             shared_state = state
+            state.start_warmup()
 
         # FIXME: currently indexStorePath can't change dynamicly. have to restart server.
         # though it rarely changes.. need to watch sourcekit-lsp implementation
@@ -443,14 +924,38 @@ def server_api():
         }
 
     def workspace_buildTargets(message):
+        from xclog_parser import topological_order
+
+        module_targets = shared_state.targets()
+        graph = shared_state.target_dependencies()
+        graph = {
+            name: [v for v in graph.get(name, ()) if v in module_targets]
+            for name in module_targets
+        }
+        targets = []
+        # dependencies first, so can prepare in order
+        for name in topological_order(graph):
+            files = module_targets[name]
+            languages = {language_ids.get(os.path.splitext(f)[1].lower()) for f in files}
+            languages.discard(None)
+            targets.append(
+                {
+                    "id": {"uri": target_uri(name)},
+                    "displayName": name,
+                    "tags": [],
+                    "capabilities": {},
+                    "languageIds": sorted(languages),  # type: ignore
+                    "dependencies": [{"uri": target_uri(v)} for v in graph[name]],
+                }
+            )
         return {
             "jsonrpc": "2.0",
             "id": message["id"],
             "result": {
-                # TODO: support real multiple target
-                "targets": [
+                # module targets from compile file, and a fallback target for other files
+                "targets": targets + [
                     {
-                        "id": {"uri": "dummy://dummy"},
+                        "id": {"uri": DUMMY_TARGET},
                         "displayName": "BuildServer",
                         "tags": ["test"],
                         "capabilities": {
@@ -474,28 +979,43 @@ def server_api():
     def buildTarget_sources(message):
         params: dict = message["params"]
         items = []
+        module_targets = None
         for target in params["targets"]:
-            if target["uri"] == "dummy://dummy":
+            if name := target_name(target["uri"]):
+                if module_targets is None:
+                    module_targets = shared_state.targets()
+                items.append(
+                    {
+                        "target": target,
+                        "sources": [
+                            {"uri": Path(f).as_uri(), "kind": 1, "generated": False}
+                            for f in module_targets.get(name, ())
+                        ],
+                    }
+                )
+            elif target["uri"] == DUMMY_TARGET:
+                # root and checkouts as directories, so new files, packages and headers not in
+                # compile file still belong to a target, and their options come from this server
+                dirs = [shared_state.root_path]
+                if shared_state.config.build_root:
+                    dirs.append(
+                        os.path.join(shared_state.config.build_root, "SourcePackages", "checkouts")
+                    )
                 sources = [
                     {
-                        # TODO: 换成真实的target和sources
-                        "uri": Path(shared_state.root_path).as_uri(),
+                        "uri": Path(d).as_uri(),
                         "kind": 2,  # 1: file, 2: directory
                         "generated": False,
-                    },
+                    }
+                    for d in dirs
                 ]
-                if shared_state.config.build_root:
-                    sources.append(
-                        {
-                            "uri": Path(
-                                shared_state.config.build_root,
-                                "SourcePackages",
-                                "checkouts",
-                            ).as_uri(),
-                            "kind": 2,  # 1: file, 2: directory
-                            "generated": False,
-                        }
-                    )
+                # files not in any module and outside the directories
+                prefixes = tuple(os.path.join(d, "") for d in dirs)
+                sources.extend(
+                    {"uri": Path(f).as_uri(), "kind": 1, "generated": False}
+                    for f in shared_state.fallback_files()
+                    if not f.startswith(prefixes)
+                )
                 items.append(
                     {
                         "target": target,
@@ -519,11 +1039,11 @@ def server_api():
 
     def textDocument_sourceKitOptions(message):
         uri = message["params"]["textDocument"]["uri"]
-        return {
-            "jsonrpc": "2.0",
-            "id": message["id"],
-            "result": shared_state.sourceKitOptions(uri),
-        }
+        # result is serialized, splice it into response
+        return '{"jsonrpc": "2.0", "id": %s, "result": %s}' % (
+            json.dumps(message["id"]),
+            shared_state.sourceKitOptions(uri) or "null",
+        )
 
     # TODO: outputPaths, no spec? #
     def build_shutdown(message):
@@ -533,49 +1053,70 @@ def server_api():
     def build_exit(message):
         sys.exit()
 
+    def xbs_stats(message):
+        """custom method: latency and payload statistics, see metrics"""
+        return {"jsonrpc": "2.0", "id": message["id"], "result": metrics.summary()}
+
     return locals()
 
 
 dispatch = server_api()
-mainlock = Lock()
+# reentrant, methods may run in main handlers which already hold it, or in worker threads
+mainlock = RLock()
+
+# requests only read compile info, can run in worker threads with a snapshot when env.concurrent
+concurrent_methods = {"textDocument/sourceKitOptions"}
+
+
+def handle_message(message):
+    def default_response():
+        if "id" in message:
+            return {
+                "jsonrpc": "2.0",
+                "id": message["id"],
+                "error": {
+                    "code": 123,
+                    "message": "unhandled method {}".format(message["method"]),
+                },
+            }
+
+    if metrics.enabled:
+        start_time = time.perf_counter()
+    response = None
+    handler = dispatch.get(message["method"].replace("/", "_"))
+    if handler:
+        try:
+            response = handler(message)
+        except Exception as e:
+            logger.exception(f"handle message error: {e}")
+            response = default_response()
+    else:
+        # ignore other notifications
+        response = default_response()
+    size = send(response) if response else 0
+    if metrics.enabled:
+        metrics.record(message["method"], time.perf_counter() - start_time, size)
 
 
 def serve():
     logger.info("Xcode Build Server Startup")
-    while True:
-        line = sys.stdin.readline()
-        if len(line) == 0:
-            break
-
-        assert line.startswith("Content-Length:")
-        length = int(line[len("Content-Length:") :])
-        sys.stdin.readline()
-        raw = sys.stdin.read(length)
-        message = json.loads(raw)
-        logger.debug("Req --> " + raw)
-
-        def default_response():
-            if "id" in message:
-                return {
-                    "jsonrpc": "2.0",
-                    "id": message["id"],
-                    "error": {
-                        "code": 123,
-                        "message": "unhandled method {}".format(message["method"]),
-                    },
-                }
+    executor = None
+    if env.concurrent:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="request")
+
+    def handle(message):
+        if executor and message["method"] in concurrent_methods and shared_state:
+            executor.submit(handle_message, message)
+            return
 
         with mainlock:
-            response = None
-            handler = dispatch.get(message["method"].replace("/", "_"))
-            if handler:
-                try:
-                    response = handler(message)
-                except Exception as e:
-                    logger.exception(f"handle message error: {e}")
-                    response = default_response()
-            else:
-                # ignore other notifications
-                response = default_response()
-            if response:
-                send(response)
+            handle_message(message)
+
+    try:
+        jsonrpc.serve(handle)
+    finally:
+        # wake observe thread to exit
+        if shared_state:
+            shared_state.shutdown()
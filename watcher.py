@@ -0,0 +1,329 @@
+"""
+watch files change for the observe thread.
+
+inotify(linux) or kqueue(macOS) is used when available, they watch parent directories,
+so replaced or new created files are catched. other platforms fallback to polling stat every second.
+"""
+
+import logging
+import os
+import select
+import struct
+import time
+from threading import Event
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def stat_key(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+class PollingWatcher(object):
+    """stat watched paths every interval"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.stats: Dict[str, Optional[tuple]] = {}
+        self.wake = Event()
+
+    def watch(self, paths: Iterable[str]):
+        # keep stats of old paths, so change between two watch won't miss
+        self.stats = {p: self.stats[p] if p in self.stats else stat_key(p) for p in paths}
+
+    def wait(self, timeout) -> Set[str]:
+        """return changed paths, empty when timeout or wakeup"""
+        deadline = time.monotonic() + timeout
+        while (remain := deadline - time.monotonic()) > 0:
+            if self.wake.wait(min(self.interval, remain)):
+                self.wake.clear()
+                return set()
+            changed = set()
+            for path, old in self.stats.items():
+                if (new := stat_key(path)) != old:
+                    self.stats[path] = new
+                    changed.add(path)
+            if changed:
+                return changed
+        return set()
+
+    def wakeup(self):
+        self.wake.set()
+
+
+# see linux/inotify.h
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def load_inotify():
+    """return libc with inotify functions, or None if not supported"""
+    import ctypes
+    import ctypes.util
+    import sys
+
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class InotifyWatcher(object):
+    """
+    watch parent directory of paths. when the directory not exists,
+    watch the nearest existing ancestor, and rewatch when it changes.
+    events in a short window are coalesced into one wait result.
+    """
+
+    def __init__(self, libc, coalesce=0.05):
+        import ctypes
+
+        self.libc = libc
+        self.coalesce = coalesce
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wake_r, self.wake_w = os.pipe()
+        self.wds: Dict[str, int] = {}  # dir: wd
+        self.dirs: Dict[int, str] = {}  # wd: dir
+        # dir: watched names. for a ancestor, the name is child dir which may be created
+        self.names: Dict[str, Set[str]] = {}
+        self.pending: Set[str] = set()
+
+    @staticmethod
+    def resolve(paths) -> Dict[str, Set[str]]:
+        names: Dict[str, Set[str]] = {}
+        for path in paths:
+            dir, name = os.path.split(os.path.abspath(path))
+            while not os.path.isdir(dir) and dir != os.path.dirname(dir):
+                dir, name = os.path.split(dir)
+            names.setdefault(dir, set()).add(name)
+        return names
+
+    def watch(self, paths: Iterable[str]):
+        paths = list(paths)
+        old_names = self.names
+        names = self.resolve(paths)
+        self.add_watches(names)
+        # dirs may be created before watch added, their events are lost. rewatch and report them
+        while (new_names := self.resolve(paths)) != names:
+            self.pending.update(d for d in new_names if d not in names)
+            names = new_names
+            self.add_watches(names)
+        # paths may be created between last wait and this watch(eg: makedirs then create file),
+        # no event for them. report the newly watched paths which exist now
+        for dir, dir_names in names.items():
+            for name in dir_names - old_names.get(dir, set()):
+                if os.path.lexists(path := os.path.join(dir, name)):
+                    self.pending.add(path)
+
+    def add_watches(self, names: Dict[str, Set[str]]):
+        for dir in list(self.wds):
+            if dir not in names:
+                self.libc.inotify_rm_watch(self.fd, self.wds.pop(dir))
+        for dir in names:
+            if dir not in self.wds:
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), WATCH_MASK)
+                if wd < 0:
+                    logger.debug(f"inotify watch {dir} failed")
+                    continue
+                self.wds[dir] = wd
+                self.dirs[wd] = dir
+        self.names = names
+
+    def read_events(self) -> Set[str]:
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # lost events, treat all as changed
+                changed.update(self.names)
+                continue
+            if (dir := self.dirs.get(wd)) is None:
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                if self.wds.get(dir) == wd:  # not removed by us, eg: dir deleted
+                    del self.wds[dir]
+                    changed.add(dir)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(dir)
+                continue
+
+            if name in self.names.get(dir, ()):
+                changed.add(os.path.join(dir, name) if name else dir)
+        return changed
+
+    def wait(self, timeout) -> Set[str]:
+        """return changed paths, empty when timeout or wakeup"""
+        deadline = time.monotonic() + timeout
+        changed, self.pending = self.pending, set()
+        coalescing = False
+        while True:
+            if changed and not coalescing:
+                # coalesce following events in a short window, eg: write then rename
+                coalescing = True
+                deadline = min(deadline, time.monotonic() + self.coalesce)
+            if (remain := deadline - time.monotonic()) <= 0:
+                return changed
+            readable, _, _ = select.select([self.fd, self.wake_r], [], [], remain)
+            if self.wake_r in readable:
+                os.read(self.wake_r, 1 << 10)
+                return changed
+            if self.fd in readable:
+                changed |= self.read_events()
+
+    def wakeup(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except OSError:
+            pass
+
+
+class KqueueWatcher(object):
+    """
+    watch parent directory of paths for entry changes, and existing paths for content changes.
+    when the directory not exists, watch the nearest existing ancestor.
+    kqueue only tells which fd changes, so changed paths are found by compare their stat.
+    events in a short window are coalesced into one wait result.
+    """
+
+    def __init__(self, coalesce=0.05):
+        self.kq = select.kqueue()
+        self.vnode_flags = (
+            select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_ATTRIB
+            | select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME | select.KQ_NOTE_REVOKE
+        )
+        self.coalesce = coalesce
+        self.wake_r, self.wake_w = os.pipe()
+        self.kq.control([select.kevent(self.wake_r, select.KQ_FILTER_READ, select.KQ_EV_ADD)], 0, 0)
+        self.fds: Dict[str, tuple] = {}  # watched dir or file: (fd, (st_dev, st_ino))
+        self.paths: list = []
+        self.stats: Dict[str, Optional[tuple]] = {}  # path: reported stat
+        self.pending: Set[str] = set()
+
+    def watch(self, paths: Iterable[str]):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.add_watches()
+        # keep stats of old paths, report change between last wait and this watch
+        stats = {}
+        for path in self.paths:
+            stats[path] = stat_key(path)
+            if path in self.stats and self.stats[path] != stats[path]:
+                self.pending.add(path)
+        self.stats = stats
+
+    def add_watches(self):
+        targets = set(InotifyWatcher.resolve(self.paths))
+        targets.update(p for p in self.paths if os.path.exists(p))
+        for target in list(self.fds):
+            if target not in targets:
+                os.close(self.fds.pop(target)[0])  # close also remove its kevent
+        for target in targets:
+            try:
+                st = os.stat(target)
+            except OSError:
+                continue
+            identity = (st.st_dev, st.st_ino)
+            if (old := self.fds.get(target)) is not None:
+                if old[1] == identity:
+                    continue
+                os.close(self.fds.pop(target)[0])  # replaced, watch the new one
+            try:
+                fd = os.open(target, getattr(os, "O_EVTONLY", os.O_RDONLY))
+            except OSError as e:
+                logger.debug(f"kqueue watch {target} failed: {e}")
+                continue
+            self.fds[target] = (fd, identity)
+            event = select.kevent(
+                fd, select.KQ_FILTER_VNODE, select.KQ_EV_ADD | select.KQ_EV_CLEAR, self.vnode_flags
+            )
+            self.kq.control([event], 0, 0)
+
+    def changed_paths(self) -> Set[str]:
+        changed = set()
+        for path, old in self.stats.items():
+            if (new := stat_key(path)) != old:
+                self.stats[path] = new
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout) -> Set[str]:
+        """return changed paths, empty when timeout or wakeup"""
+        deadline = time.monotonic() + timeout
+        changed, self.pending = self.pending, set()
+        coalescing = False
+        while True:
+            if changed and not coalescing:
+                # coalesce following events in a short window, eg: write then rename
+                coalescing = True
+                deadline = min(deadline, time.monotonic() + self.coalesce)
+            if (remain := deadline - time.monotonic()) <= 0:
+                return changed
+            events = self.kq.control(None, 64, remain)
+            if any(e.ident == self.wake_r for e in events):
+                os.read(self.wake_r, 1 << 10)
+                return changed
+            if events:
+                # dirs may be created or replaced, rewatch before compare
+                self.add_watches()
+                changed |= self.changed_paths()
+
+    def wakeup(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except OSError:
+            pass
+
+
+def create_watcher():
+    if libc := load_inotify():
+        try:
+            return InotifyWatcher(libc)
+        except OSError as e:
+            logger.debug(f"inotify not available: {e}")
+    if hasattr(select, "kqueue"):
+        try:
+            return KqueueWatcher()
+        except OSError as e:
+            logger.debug(f"kqueue not available: {e}")
+    return PollingWatcher()
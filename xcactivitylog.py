@@ -1,7 +1,8 @@
 from enum import Enum
 import os
-import subprocess
+import re
 import struct
+import zlib
 
 """this file use to convert xcactivitylog. ignore it's structure, only extract pattern log string out"""
 
@@ -17,47 +18,108 @@ class TokenType(Enum):
     Json = 7
 
 
-def tokenizer(path):
-    # pipe byte stream
-    process = subprocess.Popen(["gunzip", "--stdout", path], stdout=subprocess.PIPE)
+# gzip header and trailer, also used by gunzip
+GZIP_WBITS = zlib.MAX_WBITS | 16
+CHUNK_SIZE = 1 << 18
+
+# leading length or value, end with a type char
+token_pattern = re.compile(rb'[^-"#^(%@*]*[-"#^(%@*]')
+
+
+def gunzip_chunks(path, chunk_size=CHUNK_SIZE):
+    """yield decompressed chunks. concatenated gzip members are supported like gunzip"""
+    with open(path, "rb") as f:
+        d = zlib.decompressobj(GZIP_WBITS)
+        while data := f.read(chunk_size):
+            while True:
+                if out := d.decompress(data):
+                    yield out
+                if not d.eof:
+                    break
+                # next gzip member
+                data = d.unused_data
+                d = zlib.decompressobj(GZIP_WBITS)
+                if not data:
+                    break
+        if out := d.flush():
+            yield out
+
+
+def tokenizer(path, prefixes=None):
+    """yield (TokenType, value)
+
+    :param prefixes: str tuple. when set, String, Class and Json tokens not start with
+        one of the prefixes are skipped without decode, and won't be yield
+    """
+    if prefixes is not None:
+        prefixes = tuple(p.encode() for p in prefixes)
+        prefix_len = max(map(len, prefixes), default=0)
+    chunks = gunzip_chunks(path)
     buffer = bytearray()
-    assert process.stdout
-    head = process.stdout.read(4)
-    if head != b"SLF0":
+    pos = 0  # consumed offset in buffer. only compact when need more data
+
+    def fill(size):
+        """drop consumed bytes, and read until buffer has size bytes. return False if eof"""
+        nonlocal pos
+        del buffer[:pos]
+        pos = 0
+        while len(buffer) < size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            buffer.extend(chunk)
+        return True
+
+    def seek(offset):
+        """move pos to offset, which may beyond buffer. drop skipped data directly"""
+        nonlocal pos
+        while offset > len(buffer):
+            offset -= len(buffer)
+            buffer.clear()
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            buffer.extend(chunk)
+        pos = offset
+
+    fill(4)
+    if buffer[:4] != b"SLF0":
         raise ValueError(f"invalid file {path}, should be a xcactivitylog")
+    pos = 4
 
-    def null_handler(index):
-        del buffer[: index + 1]
+    def null_handler(begin, index):
         return (TokenType.Null, None)
 
     def int_handler(type):
-        def handler(index):
-            v = int(buffer[:index])
-            del buffer[: index + 1]
-            return (type, v)
+        def handler(begin, index):
+            return (type, int(buffer[begin:index]))
 
         return handler
 
-    def double_handler(index):
-        v = buffer[:index]
-        v = bytes.fromhex(v.decode())
-        v = struct.unpack("<d", v)[0]
-        del buffer[: index + 1]
-        return (TokenType.Double, v)
+    def double_handler(begin, index):
+        v = bytes.fromhex(buffer[begin:index].decode())
+        return (TokenType.Double, struct.unpack("<d", v)[0])
 
     def str_handler(type):
-        def handler(index):
-            length = int(buffer[:index])
+        def handler(begin, index):
+            nonlocal pos
+            length = int(buffer[begin:index])
             start = index + 1
-            available = len(buffer) - start
-            if length > available:
-                bstr = buffer[start:]
-                bstr += process.stdout.read(length - available)  # type: ignore
-                del buffer[:]
-            else:
-                bstr = buffer[start : (length + start)]
-                del buffer[: start + length]
-            return (type, bstr.decode())
+            end = start + length
+            if prefixes is not None:
+                if end > len(buffer) and start + prefix_len > len(buffer):
+                    start -= pos
+                    end -= pos
+                    fill(min(end, start + prefix_len))
+                if not buffer.startswith(prefixes, start, end):
+                    seek(end)
+                    return None
+            if end > len(buffer):
+                start -= pos
+                end -= pos
+                fill(end)
+            pos = end
+            return (type, buffer[start:end].decode())
 
         return handler
 
@@ -72,40 +134,41 @@ def tokenizer(path):
         ord(b"*"): str_handler(TokenType.Json),
     }
 
-    i = 0
-    while v := process.stdout.read(16):
-        buffer.extend(v)
-        l = len(buffer)
-        while i < l:
-            v = buffer[i]
-            if handler := handler_map.get(v):
-                yield handler(i)
-                l = len(buffer)
-                i = 0  # consume and reset
-            else:
-                i += 1
+    match = token_pattern.match
+    while True:
+        m = match(buffer, pos)
+        if m is None:
+            # incomplete token, need more data
+            if not fill(len(buffer) - pos + 1):
+                break
+            continue
+        index = m.end() - 1
+        begin = pos
+        pos = index + 1
+        if token := handler_map[buffer[index]](begin, index):
+            yield token
+
+
+compile_log_prefixes = (
+    "CompileSwiftSources ",
+    # xcode will emit SwiftDriver and SwiftDriver\\ Compilation.
+    # in my test, when build fail, will only emit SwiftDriver.
+    # but in some dependency case, only emit SwiftDriver\\ Compilation .
+    # so keep both. final will overwrite it
+    "SwiftDriver ",
+    "SwiftDriver\\ Compilation ",
+    "CompileC ",
+    "ProcessPCH",
+)
 
 
 def extract_compile_log(path):
-    for type, value in tokenizer(path):
+    # only matched strings are decoded, other log strings are skipped in raw bytes
+    for type, value in tokenizer(path, prefixes=compile_log_prefixes):
         # print(type, value)
         if type != TokenType.String:
             continue
         assert isinstance(value, str)
-        if not value.startswith(
-            (
-                "CompileSwiftSources ",
-                # xcode will emit SwiftDriver and SwiftDriver\\ Compilation.
-                # in my test, when build fail, will only emit SwiftDriver.
-                # but in some dependency case, only emit SwiftDriver\\ Compilation .
-                # so keep both. final will overwrite it
-                "SwiftDriver ",
-                "SwiftDriver\\ Compilation ",
-                "CompileC ",
-                "ProcessPCH",
-            )
-        ):
-            continue
         lines = value.splitlines()
         if len(lines) > 1:
             yield from iter(lines)
@@ -114,8 +177,21 @@ def extract_compile_log(path):
 
 def newest_logpath(metapath: str, scheme=None):
     """returns None if no metapath or no logpath"""
+    return next(iter(newest_logpaths(metapath, scheme, count=1)), None)
+
+
+# timeStoppedRecording is seconds since 2001-01-01, convert from unix timestamp
+APPLE_EPOCH_OFFSET = 978307200
+
+
+def newest_logpaths(metapath: str, scheme=None, count=None, since=None):
+    """returns logpaths sorted newest first, empty if no metapath
+
+    :param count: max count of logpaths
+    :param since: unix timestamp, only return logs stop recording after it
+    """
     if not os.path.exists(metapath):
-        return None
+        return []
 
     import plistlib
 
@@ -127,11 +203,14 @@ def newest_logpath(metapath: str, scheme=None):
         else:
             valid = bool
         logs = [v for v in meta["logs"].values() if valid(v)]
-        if not logs:
-            return None
+        if since is not None:
+            since -= APPLE_EPOCH_OFFSET
+            logs = [v for v in logs if v["timeStoppedRecording"] >= since]
 
         logs.sort(key=lambda v: v["timeStoppedRecording"], reverse=True)
-        return os.path.join(os.path.dirname(metapath), logs[0]["fileName"])
+        if count is not None:
+            logs = logs[:count]
+        return [os.path.join(os.path.dirname(metapath), v["fileName"]) for v in logs]
 
 
 def metapath_from_buildroot(build_root):
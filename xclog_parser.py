@@ -6,7 +6,8 @@ import os
 import re
 import shlex
 import sys
-from typing import Iterator, List, Optional
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional
 
 hooks_echo_to_log = False
 
@@ -17,14 +18,6 @@ def echo(s: str):
         print(s, file=sys.stderr)
 
 
-cmd_split_pattern = re.compile(
-    r"""
-        "((?:[^"]|(?<=\\)")*)" | # like "xxx xxx", allow \"
-        '([^']*)' |              # like 'xxx xxx'
-        ((?:\\[ ]|\S)+)          # like xxx\ xxx
-    """,
-    re.X,
-)
 pch_capture = re.compile(
     r"""
     -include\s (?:
@@ -38,18 +31,11 @@ pch_capture = re.compile(
 
 
 def cmd_split(s):
-    # shlex.split is slow, use a simple version, only consider most case
-    # in mine project test, custom regex is 2.54s, shlex.split is 4.9s
-    return shlex.split(s)  # shlex is more right
-
+    # shlex.split is slow, in mine project test, custom regex is 2.54s, shlex.split is 4.9s
+    # cmd_splitter use regex and fallback to shlex when not sure, result is same as shlex
+    from cmd_splitter import cmd_split
 
-def cmd_split_fast(s):
-    def extract(m):
-        if m.lastindex == 3:  # \ escape version. remove it
-            return m.group(m.lastindex).replace("\\ ", " ")
-        return m.group(m.lastindex)
-
-    return [extract(m) for m in cmd_split_pattern.finditer(s)]
+    return cmd_split(s)
 
 
 def read_until_empty_line(i: Iterator[str]) -> List[str]:
@@ -61,6 +47,18 @@ def read_until_empty_line(i: Iterator[str]) -> List[str]:
         li.append(line.strip())
 
 
+def iter_sections(i: Iterator[str]) -> Iterator[List[str]]:
+    """split lines into sections, each section end with a empty line like read_until_empty_line"""
+    section = []
+    for line in i:
+        section.append(line)
+        if not line.rstrip("\r\n"):
+            yield section
+            section = []
+    if section:
+        yield section
+
+
 def extract_swift_files_from_swiftc(command):
     # realpath解决了唯一性问题，但是swiftc好像要求传递的参数和命令行的一致...
     # TODO：如果用相对路径，有current directory的问题
@@ -90,8 +88,40 @@ def extract_swift_files_from_swiftc(command):
     return (files, fileLists, module_name, index_store_path)
 
 
+# like: import Foo, @testable import Foo, public import struct Foo.Bar
+swift_import_pattern = re.compile(
+    r"^[ \t]*(?:@\w+(?:\([^)\n]*\))?[ \t]+)*(?:(?:public|package|internal|fileprivate|private)[ \t]+)?"
+    r"import[ \t]+(?:(?:typealias|struct|class|enum|protocol|let|var|func)[ \t]+)?(\w+)",
+    re.M,
+)
+
+
+def module_imports(files, fileLists) -> List[str]:
+    """sorted module names imported by swift sources of a module. unreadable sources are skipped"""
+    from compile_database import readFileArgs
+
+    sources = list(files)
+    for l in fileLists:
+        try:
+            sources.extend(readFileArgs(l))
+        except OSError:
+            pass
+    imports = set()
+    for path in dict.fromkeys(sources):
+        try:
+            with open(path, "r", errors="replace") as f:
+                imports.update(swift_import_pattern.findall(f.read()))
+        except OSError:
+            pass
+    return sorted(imports)
+
+
 class XcodeLogParser(object):
     swiftc_exec = "bin/swiftc "
+    # section header which consume lines until empty line, match order as parse matcher
+    section_headers = ("SwiftDriver", "CompileSwiftSources ", "CompileC ")
+    # max characters of sections send to a worker once
+    batch_size = 1 << 20
     clang_exec = re.compile(r"^\s*\S*clang\S*")
 
     def __init__(self, _input: Iterator[str], _logFunc, skip_validate_bin, verbosity):
@@ -125,6 +155,9 @@ class XcodeLogParser(object):
         module["fileLists"] = files[1]
         if files[3]:
             self.index_store_path.add(files[3])
+        # dependency graph is derived from imports when load
+        if imports := module_imports(files[0], files[1]):
+            module["imports"] = imports
         echo(f"CompileSwiftModule {module['module_name']}")
         return module
 
@@ -181,6 +214,9 @@ class XcodeLogParser(object):
         module["fileLists"] = files[1]
         if files[3]:
             self.index_store_path.add(files[3])
+        # dependency graph is derived from imports when load
+        if imports := module_imports(files[0], files[1]):
+            module["imports"] = imports
         echo(f"CompileSwiftModule {module['module_name']}")
         return module
 
@@ -229,11 +265,21 @@ class XcodeLogParser(object):
         """
         if not line.startswith("ProcessPCH"):
             return
+        pch = self._record_pch(line)
+        echo(f"ProcessPCH {pch}")
+
+    def _record_pch(self, line):
         info = cmd_split(line)
         self._pch_info[" ".join(info[3:])] = info[2]
-        echo(f"ProcessPCH {info[2]}")
+        return info[2]
+
+    def parse(self, jobs=None):
+        """
+        :param jobs: worker processes to parse sections in parallel. 0 means cpu count. None or 1 parse serially
+        """
+        if jobs is not None and jobs != 1:
+            return self._parse_parallel(jobs or os.cpu_count() or 1)
 
-    def parse(self):
         from inspect import iscoroutine
         import asyncio
 
@@ -283,60 +329,459 @@ class XcodeLogParser(object):
 
         return items
 
+    def _parse_parallel(self, jobs):
+        """split input at section boundaries, and parse batches of sections in worker processes.
+
+        a section header never consume lines across empty line, so each batch parse same as serial,
+        except _pch_info, which is replayed in main process and pass the snapshot to each batch.
+        items are merged in original order, so the result is same as serial parse.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        items = []
+        self.index_store_path = set()
+        self.items = items
+
+        def batches():
+            batch = []
+            size = 0
+            pch_info = dict(self._pch_info)
+            for section in iter_sections(self._input):
+                batch.extend(section)
+                size += sum(map(len, section))
+                # lines after a section header are consumed by it, ProcessPCH there is not parsed
+                for line in section:
+                    if line.startswith(self.section_headers):
+                        break
+                    if line.startswith("ProcessPCH"):
+                        self._record_pch(line)
+                if size >= self.batch_size:
+                    yield batch, pch_info
+                    batch = []
+                    size = 0
+                    pch_info = dict(self._pch_info)
+            if batch:
+                yield batch, pch_info
+
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_log_worker, initargs=(hooks_echo_to_log,)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    parse_sections, batch, pch_info, self.skip_validate_bin, self.verbosity
+                )
+                for batch, pch_info in batches()
+            ]
+            for future in futures:
+                batch_items, index_store_path = future.result()
+                items.extend(batch_items)
+                self.index_store_path.update(index_store_path)
+
+        return items
+
 
-def dump_database(items, output):
+def parse_sections(lines, pch_info, skip_validate_bin, verbosity):
+    """parse a batch of whole sections, return (items, index_store_path)"""
+    parser = XcodeLogParser(iter(lines), echo, skip_validate_bin=skip_validate_bin, verbosity=verbosity)
+    parser._pch_info = pch_info
+    return parser.parse(), parser.index_store_path
+
+
+def _init_log_worker(echo_to_log):
+    global hooks_echo_to_log
+    hooks_echo_to_log = echo_to_log
+
+
+# version 1: list of items, each item has full command
+# version 2: {"version": 2, "commands": [command template], "items": [item]}.
+#   item["command"] is index of the commands table. a template is the command with item values replaced
+#   by placeholders, so CompileC items differ only in source and output share one template.
+#   item["command"] is kept as str if it can't be templated.
+# version 2 is opt in, other tools and older servers may only read version 1
+DATABASE_VERSION = 1
+
+
+def command_template_values(item):
+    """[(placeholder, value)] in replace order"""
+    values = []
+    if file := item.get("file"):
+        values.append(("{{file}}", file))
+    if output := item.get("output"):
+        # cover .o, .d, .dia output with same stem
+        stem = os.path.splitext(output)[0]
+        values.append(("{{output}}", stem))
+        # like -index-unit-output-path /Project.build/.../name.o
+        values.append(("{{name}}", f"/{os.path.basename(stem)}."))
+    return values
+
+
+def expand_command(template: str, item):
+    for placeholder, value in reversed(command_template_values(item)):
+        template = template.replace(placeholder, value)
+    return template
+
+
+def make_command_template(item) -> Optional[str]:
+    """return None if the command can't be templated and restored exactly"""
+    command = item["command"]
+    values = command_template_values(item)
+    if any(placeholder in command for placeholder, _ in values) or "{{" in command:
+        return None
+    template = command
+    for placeholder, value in values:
+        template = template.replace(value, placeholder)
+    if expand_command(template, item) != command:
+        return None
+    return template
+
+
+def compact_database(items, version=DATABASE_VERSION):
+    """return json data of the database version"""
+    if version >= 2:
+        commands = []
+        command_index = {}
+
+        def compact(item):
+            if not (isinstance(item, dict) and isinstance(item.get("command"), str)):
+                return item
+            template = make_command_template(item)
+            if template is None:
+                return item
+            if (index := command_index.get(template)) is None:
+                index = command_index[template] = len(commands)
+                commands.append(template)
+            return {**item, "command": index}
+
+        return {"version": 2, "items": [compact(item) for item in items], "commands": commands}
+    return items
+
+
+def dump_database(items, output, version=DATABASE_VERSION):
     import json
 
+    items = compact_database(items, version)
     # pretty print, easy to read with editor. compact save little size. only about 0.2%
     json.dump(items, output, ensure_ascii=False, check_circular=False, indent="\t")
 
 
-def merge_database(items, database_path):
+def load_database(input) -> List[dict]:
+    """load database of any version, return version 1 items"""
     import json
 
-    #  TODO: swiftc模块的增量更新
-    # 根据ident(file属性)，增量覆盖更新
-    def identifier(item):
-        if isinstance(item, dict):
-            return item.get("file") or item.get("module_name")
-        return None  # other type info without identifier simplely append into file
+    return expand_database(json.load(input))
 
-    with open(database_path, "r") as f:
-        # try best effort to keep old data
-        old_items = json.load(f)
 
-        new_file_map = {}
-        for item in items:
-            ident = identifier(item)
+def expand_database(data) -> List[dict]:
+    """convert json data of any version to version 1 items"""
+    if isinstance(data, list):
+        return data
+
+    commands = data["commands"]
+    items = data["items"]
+    for item in items:
+        if isinstance(item, dict) and isinstance(command := item.get("command"), int):
+            item["command"] = expand_command(commands[command], item)
+    return items
+
+
+def identifier(item):
+    if isinstance(item, dict):
+        return item.get("file") or item.get("module_name")
+    return None  # other type info without identifier simplely append into file
+
+
+def merge_items(old_items, items):
+    """return merged list. item in items overwrite old item with same identifier"""
+    # 根据ident(file属性)，增量覆盖更新
+    new_file_map = {}
+    for item in items:
+        ident = identifier(item)
+        if ident:
+            # swift-driver和swift-compile的重复看来是正常的，命令也一样。所以先兼容观察一段时间
+            # if ident in new_file_map:
+            #     echo(f"Error: duplicate compile for {ident}")
+            new_file_map[ident] = item
+
+    dealed = set()
+
+    def get_new_item(old_item):
+        if isinstance(old_item, dict):
+            ident = identifier(old_item)
             if ident:
-                # swift-driver和swift-compile的重复看来是正常的，命令也一样。所以先兼容观察一段时间
-                # if ident in new_file_map:
-                #     echo(f"Error: duplicate compile for {ident}")
-                new_file_map[ident] = item
+                dealed.add(ident)
+
+                new_item = new_file_map.get(ident)
+                if new_item:
+                    return new_item
+        return old_item
+
+    # 旧item中不变的, 以及被更新的，和新item中新添加的
+    final = [get_new_item(item) for item in old_items]
+    final.extend(item for item in items if identifier(item) not in dealed)
+    return final
+
+
+def module_dependencies(items) -> Dict[str, List[str]]:
+    """
+    {module name: [dependency module names]} of swift module items, by the imports recorded when parse.
+    only modules in items are kept. modules can't import each other, edges closing a cycle are dropped.
+    """
+    imports = defaultdict(set)  # same module name may have items for multiple arch
+    for item in items:
+        if isinstance(item, dict) and (name := item.get("module_name")):
+            imports[name].update(item.get("imports") or ())
+
+    graph = {}
+    visiting = set()
+    for root in sorted(imports):
+        if root in graph:
+            continue
+        # iterative dfs, deep module chain may exceed recursion limit
+        visiting.add(root)
+        graph[root] = []
+        stack = [(root, iter(sorted(imports[root])))]
+        while stack:
+            current, deps = stack[-1]
+            for dep in deps:
+                if dep not in imports or dep in visiting:
+                    continue  # not a module in items, or cycle
+                graph[current].append(dep)
+                if dep not in graph:
+                    visiting.add(dep)
+                    graph[dep] = []
+                    stack.append((dep, iter(sorted(imports[dep]))))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(current)
+    return graph
+
+
+def topological_order(graph: Dict[str, List[str]]) -> List[str]:
+    """return names with dependencies first. edges in a cycle are ignored"""
+    order = []
+    state = {}  # name: False when visiting, True when done
+
+    def visit(name):
+        # iterative dfs, deep module chain may exceed recursion limit
+        stack = [(name, iter(graph.get(name, ())))]
+        state[name] = False
+        while stack:
+            current, deps = stack[-1]
+            for dep in deps:
+                if dep in state:
+                    continue  # done, or cycle
+                state[dep] = False
+                stack.append((dep, iter(graph.get(dep, ()))))
+                break
+            else:
+                stack.pop()
+                state[current] = True
+                order.append(current)
+
+    for name in sorted(graph):
+        if name not in state:
+            visit(name)
+    return order
+
+
+# merged items are appended to journal instead of rewrite the database,
+# until journal size exceed this ratio of database size, or journal lines exceed the limit,
+# then compact them into database
+JOURNAL_COMPACT_RATIO = 0.25
+JOURNAL_MAX_LINES = 256
+
+
+def database_journal_path(database_path):
+    """journal file, each line is a json database of merged items, replay in order after database"""
+    return database_path + ".journal"
 
-        dealed = set()
 
-        def get_new_item(old_item):
-            if isinstance(old_item, dict):
-                ident = identifier(old_item)
-                if ident:
-                    dealed.add(ident)
+def load_database_file(database_path) -> List[dict]:
+    """load database at path and replay its journal, return version 1 items"""
+    import json
+
+    with open(database_path, "r") as f:
+        items = load_database(f)
+    # fold journal into one record, then merge once. later item overwrite earlier but keep its position,
+    # same as merge lines one by one
+    journal = {}  # {identifier or (None, seq) for item without identifier: item}
+    try:
+        with open(database_journal_path(database_path), "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    echo(f"Error: skip broken journal line of {database_path}")
+                    continue
+                for item in expand_database(data):
+                    journal[identifier(item) or (None, len(journal))] = item
+    except FileNotFoundError:
+        pass
+    if journal:
+        items = merge_items(items, list(journal.values()))
+    return items
+
 
-                    new_item = new_file_map.get(ident)
-                    if new_item:
-                        return new_item
-            return old_item
+def count_lines(path):
+    try:
+        with open(path, "rb") as f:
+            return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+    except FileNotFoundError:
+        return 0
 
-        # 旧item中不变的, 以及被更新的，和新item中新添加的
-        final = [get_new_item(item) for item in old_items]
-        final.extend(item for item in items if identifier(item) not in dealed)
 
+def write_database(items, database_path, version=DATABASE_VERSION):
+    """replace the whole database, old journal is dropped"""
     tmp_path = database_path + ".tmp"
     with open(tmp_path, "w") as f:
-        dump_database(final, f)
+        dump_database(items, f, version)
+    from misc import force_remove
+
+    # NOTE: remove journal first, reader may see old database without journal, but never replay
+    # old journal on new database
+    force_remove(database_journal_path(database_path))
     os.replace(tmp_path, database_path)
 
 
+def database_file_version(database_path):
+    """version of database file, detected from its head"""
+    with open(database_path, "r") as f:
+        head = f.read(64)
+    if m := re.match(r'\s*\{\s*"version"\s*:\s*(\d+)', head):
+        return int(m.group(1))
+    return 1
+
+
+def merge_database(items, database_path, version=None):
+    """
+    merge items into database. cost is proportion to items, except when compact journal
+    :param version: None to keep the version of database
+    """
+    import json
+
+    if version is None:
+        version = database_file_version(database_path)
+    journal_path = database_journal_path(database_path)
+    record = json.dumps(compact_database(items, version), ensure_ascii=False, check_circular=False)
+    try:
+        journal_size = os.path.getsize(journal_path)
+    except FileNotFoundError:
+        journal_size = 0
+    if (
+        journal_size + len(record) <= os.path.getsize(database_path) * JOURNAL_COMPACT_RATIO
+        and count_lines(journal_path) < JOURNAL_MAX_LINES
+    ):
+        with open(journal_path, "a") as f:
+            f.write(record + "\n")
+        os.utime(database_path)  # database changed, notify observer
+        return
+
+    # try best effort to keep old data
+    final = merge_items(load_database_file(database_path), items)
+    write_database(final, database_path, version)
+
+
+# sqlite database: items are upserted by identifier, files are indexed by filekey for on demand lookup
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commands (id INTEGER PRIMARY KEY, command TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS items (
+    seq INTEGER PRIMARY KEY, ident TEXT UNIQUE, module_name TEXT, command_id INTEGER, directory TEXT, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, dir TEXT NOT NULL, directory TEXT, item INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_item ON files (item);
+CREATE INDEX IF NOT EXISTS items_module_name ON items (module_name);
+CREATE INDEX IF NOT EXISTS items_command_id ON items (command_id);
+"""
+
+
+def upsert_sqlite_item(conn, item):
+    """insert item, or replace the item with same identifier and its files"""
+    import json
+    from compile_database import filekey, readFileArgs
+
+    if not isinstance(item, dict):
+        return
+    ident = identifier(item)
+    command = item.get("command")
+    command_id = None
+    if command:
+        conn.execute("INSERT OR IGNORE INTO commands (command) VALUES (?)", (command,))
+        (command_id,) = conn.execute(
+            "SELECT id FROM commands WHERE command = ?", (command,)
+        ).fetchone()
+    data = json.dumps({k: v for k, v in item.items() if k != "command"}, ensure_ascii=False)
+    row = (item.get("module_name"), command_id, item.get("directory"), data)
+
+    seq = None
+    if ident is not None:
+        if old := conn.execute("SELECT seq FROM items WHERE ident = ?", (ident,)).fetchone():
+            (seq,) = old
+            conn.execute("DELETE FROM files WHERE item = ?", (seq,))
+            conn.execute(
+                "UPDATE items SET module_name = ?, command_id = ?, directory = ?, data = ? WHERE seq = ?",
+                (*row, seq),
+            )
+    if seq is None:
+        seq = conn.execute(
+            "INSERT INTO items (ident, module_name, command_id, directory, data) VALUES (?, ?, ?, ?, ?)",
+            (ident, *row),
+        ).lastrowid
+
+    if not command:
+        return
+    directory = item.get("directory")
+
+    # same as CompileFileInfo.load
+    def files():
+        for f in item.get("files") or ():  # batch files, eg: swift module
+            yield f, None
+        for l in item.get("fileLists") or ():  # file list store in a dedicated file
+            if os.path.isfile(l):
+                for f in readFileArgs(l):
+                    yield f, directory
+        if file := item.get("file"):  # single file info
+            yield file, directory
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO files (key, dir, directory, item) VALUES (?, ?, ?, ?)",
+        ((key, os.path.dirname(key), d, seq) for f, d in files() for key in (filekey(f),)),
+    )
+
+
+def dump_sqlite(items, database_path, append=False):
+    """write items into sqlite database.
+
+    :param append: upsert items into exist database, instead of rewrite all
+    """
+    import sqlite3
+    from misc import force_remove
+
+    # always write a copy and replace, server may be reading the old one as a immutable snapshot
+    path = database_path + ".tmp"
+    force_remove(path)
+    if append:
+        import shutil
+
+        shutil.copyfile(database_path, path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SQLITE_SCHEMA)
+        with conn:  # transaction
+            for item in items:
+                upsert_sqlite_item(conn, item)
+            conn.execute(
+                "DELETE FROM commands WHERE id NOT IN"
+                " (SELECT command_id FROM items WHERE command_id IS NOT NULL)"
+            )
+    finally:
+        conn.close()
+    os.replace(path, database_path)
+
+
 def output_lock_path(output_path):
     return output_path + ".lock"
 
@@ -348,6 +793,10 @@ class OutputLockedError(FileExistsError):
     pass
 
 
+# exit code when output is locked by other parse. EX_TEMPFAIL
+LOCKED_EXIT_CODE = 75
+
+
 def within_output_lock(output_path, action, timeout=180):
     """raise OutputLockedError when already locked"""
     # lock and trigger parse compile
@@ -379,24 +828,89 @@ def within_output_lock(output_path, action, timeout=180):
         force_remove(lock_path)
 
 
+def parse_log(xcpath, skip_validate_bin, verbosity):
+    """parse a single xcactivitylog, return (items, index_store_path)"""
+    from xcactivitylog import extract_compile_log
+
+    echo(f"extract_compile_log at {xcpath}")
+    parser = XcodeLogParser(
+        extract_compile_log(xcpath), echo, skip_validate_bin=skip_validate_bin, verbosity=verbosity
+    )
+    return parser.parse(), parser.index_store_path
+
+
+def parse_logs(xcpaths, skip_validate_bin, verbosity, jobs=None):
+    """parse xcactivitylogs in a process pool, one log per worker.
+
+    :param xcpaths: sorted newest first. newer item overwrite older item with same identifier
+    :return: (items, index_store_path)
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = []
+    index_store_path = set()
+    oldest_first = list(reversed(xcpaths))
+    with ProcessPoolExecutor(
+        max_workers=min(len(xcpaths), jobs or os.cpu_count() or 1),
+        initializer=_init_log_worker,
+        initargs=(hooks_echo_to_log,),
+    ) as executor:
+        results = executor.map(
+            parse_log,
+            oldest_first,
+            (skip_validate_bin for _ in oldest_first),
+            (verbosity for _ in oldest_first),
+        )
+        for log_items, log_index_store_path in results:
+            items = merge_items(items, log_items)
+            index_store_path.update(log_index_store_path)
+    return items, index_store_path
+
+
+def parse_since(value: str):
+    """return unix timestamp from relative time(eg: 30m, 2h, 1d) or iso datetime"""
+    from time import time
+
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if m := re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value):
+        return time() - float(m.group(1)) * units[m.group(2)]
+
+    from datetime import datetime
+
+    return datetime.fromisoformat(value).timestamp()
+
+
 def _parse(args):
     from xcactivitylog import (
-        newest_logpath,
+        newest_logpaths,
         extract_compile_log,
         metapath_from_buildroot,
     )
 
     """args: same as main.parse args"""
+    items = None
     if args.sync:
-        xcpath = newest_logpath(metapath_from_buildroot(args.sync), scheme=args.scheme)
-        if not xcpath:
+        multiple = args.logs is not None or args.since is not None
+        xcpaths = newest_logpaths(
+            metapath_from_buildroot(args.sync),
+            scheme=args.scheme,
+            count=args.logs if multiple else 1,
+            since=args.since,
+        )
+        if not xcpaths:
             echo(
                 f"no newest_logpath xcactivitylog at {args.sync}/Logs/Build/LogStoreManifest.plist"
             )
             return 1
 
-        echo(f"extract_compile_log at {xcpath}")
-        in_fd = extract_compile_log(xcpath)
+        if len(xcpaths) > 1:
+            echo(f"parse {len(xcpaths)} xcactivitylogs at {args.sync}")
+            items, index_store_paths = parse_logs(
+                xcpaths, skip_validate_bin=args.skip_validate_bin, verbosity=args.verbose, jobs=args.jobs
+            )
+        else:
+            echo(f"extract_compile_log at {xcpaths[0]}")
+            in_fd = extract_compile_log(xcpaths[0])
     elif args.xcactivitylog:
         in_fd = extract_compile_log(args.xcactivitylog)
     elif args.input == "-":
@@ -406,15 +920,17 @@ def _parse(args):
     else:
         in_fd = open(args.input, "r")
 
-    parser = XcodeLogParser(in_fd, echo, skip_validate_bin=args.skip_validate_bin, verbosity=args.verbose)
-    items = parser.parse()
+    if items is None:
+        parser = XcodeLogParser(in_fd, echo, skip_validate_bin=args.skip_validate_bin, verbosity=args.verbose)
+        items = parser.parse(jobs=args.jobs)
+        index_store_paths = parser.index_store_path
 
     if args.output == "-":
-        return dump_database(items, sys.stdout)
+        return dump_database(items, sys.stdout, args.database_version or DATABASE_VERSION)
     if not args.output:
         output = default_output_path
 
-        for index_store_path in parser.index_store_path:
+        for index_store_path in index_store_paths:
             echo(f"use index_store_path at {index_store_path}")
             break
         else:
@@ -430,13 +946,22 @@ def _parse(args):
     else:
         output = args.output
 
-    if args.append and os.path.exists(output):
-        merge_database(items, output)
+    from compile_database import isSqliteDatabase
+
+    if args.sqlite or isSqliteDatabase(output):
+        if args.append and isSqliteDatabase(output):
+            dump_sqlite(items, output, append=True)
+        else:
+            if args.append and os.path.exists(output):  # convert from json database
+                items = merge_items(load_database_file(output), items)
+            from misc import force_remove
+
+            force_remove(database_journal_path(output))
+            dump_sqlite(items, output)
+    elif args.append and os.path.exists(output):
+        merge_database(items, output, args.database_version)
     else:
-        tmp_path = output + ".tmp"
-        with open(tmp_path, "w") as f:
-            dump_database(items, f)
-        os.replace(tmp_path, output)
+        write_database(items, output, args.database_version or DATABASE_VERSION)
 
 
 def parse(argv):
@@ -467,6 +992,34 @@ def parse(argv):
         "--sync",
         help="xcode build root path, use to extract newest xcactivitylog, eg: /Users/xxx/Library/Developer/Xcode/DerivedData/XXXProject-xxxhash/",
     )
+    parser.add_argument(
+        "--logs",
+        type=int,
+        help="use with --sync, parse newest N xcactivitylogs in parallel. newer log overwrite older",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_since,
+        help="use with --sync, parse xcactivitylogs since time in parallel, eg: 2h, 1d, 2024-01-01T08:00",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="worker processes to parse log sections(or logs with --logs) in parallel, 0 means cpu count. default parse a log serially",
+    )
+    parser.add_argument(
+        "--database-version",
+        type=int,
+        choices=[1, 2],
+        help=f"output format version. 1 save full command for each item, 2 share commands in a table."
+        f" default: {DATABASE_VERSION}, append keeps the version of output",
+    )
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help="save output as sqlite database, which server query on demand. append to a sqlite output upsert items into it",
+    )
     parser.add_argument(
         "--scheme",
         help=argparse.SUPPRESS
@@ -485,15 +1038,26 @@ def parse(argv):
         help="Setup levels of verbosity of output (e.g., -v -vv -vvv).\n -v is for passing through errors,\n -vv is for passing through errors and warnings,\n -vvv is for passing through error, warnings and notes."
     )
     a = parser.parse_args(argv[1:])
+    if (a.logs is not None or a.since is not None) and not a.sync:
+        parser.error("--logs and --since should be used with --sync")
+    if a.sqlite and a.output == "-":
+        parser.error("--sqlite can't output to stdout")
     within_output_lock(a.output, lambda: _parse(a))
 
 
 def main(argv=sys.argv):
+    import signal
+
+    def terminate(signum, frame):
+        # exit normally, so output lock is released
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, terminate)
     try:
         parse(argv)
     except OutputLockedError as e:
         echo(f"{e.filename} exists! parse already run")
-        sys.exit(1)
+        sys.exit(LOCKED_EXIT_CODE)
 
 
 if __name__ == "__main__":